@@ -0,0 +1,85 @@
+import asyncio
+import inspect
+from typing import Callable, Dict
+
+# ====== 房间 actor ======
+# 每个房间一个 asyncio 任务，从命令队列里依次取出命令执行：
+# 同一房间的修改严格串行、不需要锁，不同房间的 actor 互不等待。
+
+_STOP = object()
+
+
+class RoomBusy(Exception):
+    """房间命令队列已满"""
+
+
+class RoomActor:
+    """串行执行一个房间的命令
+
+    命令是普通函数或协程函数，返回值/异常通过 future 交回调用方。
+    """
+
+    __slots__ = ("room_id", "max_queue", "queue", "task")
+
+    def __init__(self, room_id: str, max_queue: int):
+        self.room_id = room_id
+        self.max_queue = max_queue
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, fn: Callable, *args) -> asyncio.Future:
+        if self.queue.qsize() >= self.max_queue:
+            raise RoomBusy(self.room_id)
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, future))
+        return future
+
+    def stop(self):
+        """已经排队的命令照常执行完，然后退出"""
+        self.queue.put_nowait(_STOP)
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            fn, args, future = item
+            if future.cancelled():
+                continue
+            try:
+                result = fn(*args)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+
+class ActorRegistry:
+    """room_id -> RoomActor，按需创建"""
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self.actors: Dict[str, RoomActor] = {}
+
+    def get(self, room_id: str) -> RoomActor:
+        actor = self.actors.get(room_id)
+        if actor is None or actor.task.done():
+            actor = self.actors[room_id] = RoomActor(room_id, self.max_queue)
+        return actor
+
+    def stop(self, room_id: str):
+        """房间删除后调用；之后的新命令会由新的 actor 处理"""
+        actor = self.actors.pop(room_id, None)
+        if actor is not None:
+            actor.stop()
+
+    async def close(self):
+        actors = list(self.actors.values())
+        self.actors.clear()
+        for actor in actors:
+            actor.stop()
+        await asyncio.gather(*(a.task for a in actors), return_exceptions=True)
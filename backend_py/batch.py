@@ -0,0 +1,320 @@
+# 向量化批量引擎：N 局游戏存成 NumPy 数组，按回合同步推进，用于蒙特卡洛推演
+# 依赖 numpy（可选依赖，只有 AI 对手 / 提示功能需要）
+# 用法（在 backend_py 目录下）：python -m batch --games 100000 --players 5
+import argparse
+import time
+from typing import Optional
+
+import numpy as np
+
+from engine import (
+    COMPANY_CARD_COUNTS,
+    HAND_SIZE,
+    LAST_ROUND,
+    N_COMPANIES,
+    REMOVED_CARDS,
+    SETTLEMENT,
+    START_MONEY,
+    Game,
+)
+from settlement import PAYOUT_PER_SHARE, PODIUM_POINTS
+
+DECK_SIZE = sum(COMPANY_CARD_COUNTS)
+PLAY_SIZE = DECK_SIZE - REMOVED_CARDS
+BASE_DECK = np.frombuffer(SETTLEMENT.base_deck, np.int8)
+EMPTY = -1
+
+
+def _leaders(inv: np.ndarray):
+    """inv: (..., players, companies)，返回每家公司的唯一最大股东，没有则为 -1"""
+    top = inv.max(axis=-2)
+    count = (inv == top[..., None, :]).sum(axis=-2)
+    leader = inv.argmax(axis=-2)
+    return np.where((top > 0) & (count == 1), leader, EMPTY).astype(np.int8)
+
+
+def settle(inv: np.ndarray, money: np.ndarray, score: np.ndarray) -> np.ndarray:
+    """回合结算：inv (N, P, 6) 已经并入手牌，原地修改 money / score (N, P)，返回各局的最大股东
+
+    与 settlement.RoundSettlement 的结果逐项相同（tests/test_settlement.py 会比对）。
+    """
+    rows = np.arange(len(inv))
+    seats = np.arange(inv.shape[1])
+    leaders = _leaders(inv)
+    # 公司之间按顺序结算：前一家的付款会影响后一家的 min(余额, 欠款)
+    for c in range(N_COMPANIES):
+        major = leaders[:, c]
+        payer = (major[:, None] != EMPTY) & (seats[None, :] != major[:, None])
+        owed = np.where(payer, inv[:, :, c] * PAYOUT_PER_SHARE, 0)
+        received = np.where(payer, np.minimum(money, owed), 0).sum(axis=1)
+        money -= owed
+        has_major = major != EMPTY
+        money[rows[has_major], major[has_major]] += received[has_major]
+
+    order = np.argsort(-money, axis=1, kind="stable")
+    score[rows, order[:, 0]] += PODIUM_POINTS[0]
+    score[rows, order[:, 1]] += PODIUM_POINTS[1]
+    score[rows, order[:, -1]] += PODIUM_POINTS[2]
+    return leaders
+
+
+def _pick(options: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """每行在 True 的位置里均匀随机选一个"""
+    keys = np.where(options, rng.random(options.shape), -1.0)
+    return keys.argmax(axis=1)
+
+
+class BatchGames:
+    """N 局人数相同的游戏，所有状态都是按局堆叠的数组
+
+      deck      (N, 40)    牌库，deck_len 之前有效，末尾是牌顶
+      pool      (N, 40)    未被移除的 40 张牌，下一回合重洗用
+      hands     (N, P, 6)  手牌按公司计数（规则不关心手牌顺序）
+      inv       (N, P, 6)  持股矩阵
+      market    (N, 40)    市场牌槽位，EMPTY 表示空位；coins 是对应槽位上的金币
+      owner     (N, 6)     反垄断标记持有者
+      phase     (N,)       0 = 等待拿牌（手里正好 3 张才能抽或拿），1 = 等待打牌
+    所有局都用均匀随机的合法动作推进。
+    """
+
+    def __init__(self, n_games: int, n_players: int, rng: np.random.Generator):
+        self.rng = rng
+        self.n_players = n_players
+        n, p = n_games, n_players
+        self.deck = np.zeros((n, PLAY_SIZE), np.int8)
+        self.pool = np.zeros((n, PLAY_SIZE), np.int8)
+        self.deck_len = np.zeros(n, np.int16)
+        self.hands = np.zeros((n, p, N_COMPANIES), np.int16)
+        self.inv = np.zeros((n, p, N_COMPANIES), np.int16)
+        self.money = np.full((n, p), START_MONEY, np.int32)
+        self.score = np.zeros((n, p), np.int32)
+        self.market = np.full((n, PLAY_SIZE), EMPTY, np.int8)
+        self.coins = np.zeros((n, PLAY_SIZE), np.int32)
+        self.owner = np.full((n, N_COMPANIES), EMPTY, np.int8)
+        self.current = np.zeros(n, np.int16)
+        self.round = np.ones(n, np.int16)
+        self.phase = np.zeros(n, np.int8)
+        self.done = np.zeros(n, bool)
+        self.stalled = np.zeros(n, bool)
+
+    # ---- 构造 ----
+    @classmethod
+    def new(cls, n_games: int, n_players: int, seed: Optional[int] = None) -> "BatchGames":
+        """N 局全新的游戏"""
+        batch = cls(n_games, n_players, np.random.default_rng(seed))
+        perm = batch.rng.random((n_games, DECK_SIZE)).argsort(axis=1)
+        shuffled = BASE_DECK[perm]
+        batch.pool[:] = shuffled[:, :PLAY_SIZE]
+        batch.deck[:] = batch.pool
+        batch.deck_len[:] = PLAY_SIZE
+        batch._deal(np.arange(n_games))
+        return batch
+
+    @classmethod
+    def from_game(
+        cls,
+        game: Game,
+        n_games: int,
+        seed: Optional[int] = None,
+        resample_deck: bool = True,
+    ) -> "BatchGames":
+        """把一局进行中的游戏复制 N 份；resample_deck 时每份的剩余牌库单独重洗"""
+        n, p = n_games, len(game.player_ids)
+        batch = cls(n, p, np.random.default_rng(seed))
+        batch.pool[:] = np.frombuffer(bytes(SETTLEMENT.deck(game.removed)), np.int8)
+        deck_len = len(game.deck)
+        deck = np.frombuffer(bytes(game.deck), np.int8)
+        if resample_deck and deck_len:
+            perm = batch.rng.random((n, deck_len)).argsort(axis=1)
+            batch.deck[:, :deck_len] = deck[perm]
+        else:
+            batch.deck[:, :deck_len] = deck
+        batch.deck_len[:] = deck_len
+        for seat, hand in enumerate(game.hands):
+            batch.hands[:, seat] = np.bincount(
+                np.frombuffer(bytes(hand), np.int8), minlength=N_COMPANIES
+            )
+        batch.inv[:] = np.frombuffer(bytes(game.investments), np.uint8).reshape(
+            p, N_COMPANIES
+        )
+        batch.money[:] = np.asarray(game.money)
+        batch.score[:] = np.asarray(game.score)
+        m = len(game.market)
+        batch.market[:, :m] = np.frombuffer(bytes(game.market), np.int8)
+        batch.coins[:, :m] = np.asarray(game.market_coins)
+        batch.owner[:] = np.asarray(game.owner)
+        batch.current[:] = game.current
+        batch.round[:] = game.round_number
+        batch.phase[:] = len(game.hands[game.current]) != HAND_SIZE
+        batch.done[:] = game.status == "game_over"
+        return batch
+
+    # ---- 推进 ----
+    def _deal(self, idx: np.ndarray):
+        for seat in range(self.n_players):
+            for _ in range(HAND_SIZE):
+                top = self.deck_len[idx] - 1
+                self.hands[idx, seat, self.deck[idx, top]] += 1
+                self.deck_len[idx] = top
+
+    def _acquire(self, idx: np.ndarray):
+        cur = self.current[idx]
+        market = self.market[idx]
+        present = market != EMPTY
+        slot_owner = np.take_along_axis(self.owner[idx], np.where(present, market, 0), 1)
+        takable = present & (slot_owner != cur[:, None])
+        # 抽牌费用 = 市场上不归自己反垄断的牌数，恰好等于可拿的牌数
+        cost = takable.sum(axis=1)
+        can_draw = (self.deck_len[idx] > 0) & (self.money[idx, cur] >= cost)
+        full = self.hands[idx, cur].sum(axis=1) == HAND_SIZE
+        options = np.concatenate([can_draw[:, None], takable], axis=1) & full[:, None]
+
+        # 手里不是 3 张，或者既抽不起牌也没有能拿的牌：跳过拿牌，直接从手里打一张
+        skip = ~options.any(axis=1)
+        if skip.any():
+            self.phase[idx[skip]] = 1
+            keep = ~skip
+            idx, cur, cost, options = idx[keep], cur[keep], cost[keep], options[keep]
+
+        choice = _pick(options, self.rng)
+        draw = choice == 0
+
+        d, dc = idx[draw], cur[draw]
+        top = self.deck_len[d] - 1
+        self.hands[d, dc, self.deck[d, top]] += 1
+        self.deck_len[d] = top
+        self.money[d, dc] -= cost[draw]
+
+        t, tc, slot = idx[~draw], cur[~draw], choice[~draw] - 1
+        self.hands[t, tc, self.market[t, slot]] += 1
+        self.money[t, tc] += self.coins[t, slot]
+        self.market[t, slot] = EMPTY
+        self.coins[t, slot] = 0
+
+        self.phase[idx] = 1
+
+    def _play(self, idx: np.ndarray):
+        cur = self.current[idx]
+        held = self.hands[idx, cur] > 0
+        # 手里一张牌都没有，这一回合再也拿不到牌，无法继续
+        stuck = ~held.any(axis=1)
+        if stuck.any():
+            self.stalled[idx[stuck]] = True
+            self.done[idx[stuck]] = True
+            idx, cur, held = idx[~stuck], cur[~stuck], held[~stuck]
+            if not len(idx):
+                return
+        not_owner = self.owner[idx] != cur[:, None]
+        # 前 6 列投资，后 6 列放到市场
+        choice = _pick(np.concatenate([held, held & not_owner], axis=1), self.rng)
+        company = choice % N_COMPANIES
+        invest = choice < N_COMPANIES
+        self.hands[idx, cur, company] -= 1
+
+        i, ic, c = idx[invest], cur[invest], company[invest]
+        self.inv[i, ic, c] += 1
+        self.owner[i, c] = _leaders(self.inv[i])[np.arange(len(i)), c]
+
+        m = idx[~invest]
+        slot = (self.market[m] == EMPTY).argmax(axis=1)
+        self.market[m, slot] = company[~invest]
+
+        self.phase[idx] = 0
+        self._end_round(idx[self.deck_len[idx] == 0])
+        live = idx[~self.done[idx]]
+        self.current[live] = (self.current[live] + 1) % self.n_players
+
+    def _end_round(self, idx: np.ndarray):
+        if not len(idx):
+            return
+        inv = self.inv[idx] + self.hands[idx]
+        self.inv[idx] = inv
+        self.hands[idx] = 0
+
+        money = self.money[idx]
+        score = self.score[idx]
+        leaders = settle(inv, money, score)
+        self.money[idx] = money
+        self.score[idx] = score
+
+        last = self.round[idx] >= LAST_ROUND
+        self.done[idx[last]] = True
+        nxt = idx[~last]
+        if not len(nxt):
+            return
+        self.round[nxt] += 1
+        perm = self.rng.random((len(nxt), PLAY_SIZE)).argsort(axis=1)
+        self.deck[nxt] = np.take_along_axis(self.pool[nxt], perm, 1)
+        self.deck_len[nxt] = PLAY_SIZE
+        self.market[nxt] = EMPTY
+        self.coins[nxt] = 0
+        self._deal(nxt)
+        self.current[nxt] = 0
+        self.owner[nxt] = leaders[~last]
+
+    def step(self):
+        """所有未结束的局各走一回合"""
+        active = ~self.done
+        acquire = np.flatnonzero(active & (self.phase == 0))
+        if len(acquire):
+            self._acquire(acquire)
+        play = np.flatnonzero(~self.done & (self.phase == 1))
+        if len(play):
+            self._play(play)
+
+    def run(self, max_turns: int = 1000):
+        for _ in range(max_turns):
+            if self.done.all():
+                break
+            self.step()
+        return self
+
+    # ---- 统计 ----
+    def win_shares(self) -> np.ndarray:
+        """(N, P)，平局时胜利平分；stalled 的局记 0"""
+        best = self.score.max(axis=1, keepdims=True)
+        winners = (self.score == best).astype(np.float64)
+        winners /= winners.sum(axis=1, keepdims=True)
+        winners[self.stalled] = 0
+        return winners
+
+
+def rollout(
+    game: Game,
+    n: int = 1000,
+    seed: Optional[int] = None,
+    resample_deck: bool = True,
+) -> dict:
+    """从当前局面随机推演 n 局，返回每个玩家的期望得分和胜率"""
+    batch = BatchGames.from_game(game, n, seed, resample_deck).run()
+    finished = ~batch.stalled
+    count = int(finished.sum())
+    mean_score = batch.score[finished].mean(axis=0) if count else np.zeros(batch.n_players)
+    win_rate = batch.win_shares().sum(axis=0) / max(count, 1)
+    return {
+        "rollouts": n,
+        "stalled": n - count,
+        "expected_score": dict(zip(game.player_ids, mean_score.round(3).tolist())),
+        "win_rate": dict(zip(game.player_ids, win_rate.round(4).tolist())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy 批量引擎吞吐")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=4, choices=range(3, 8))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    batch = BatchGames.new(args.games, args.players, args.seed).run()
+    elapsed = time.perf_counter() - start
+    print(f"games          {args.games}")
+    print(f"seconds        {elapsed:.3f}")
+    print(f"games_per_sec  {args.games / elapsed:.1f}")
+    print(f"stalled        {int(batch.stalled.sum())}")
+    print(f"seat_win_rate  {(batch.win_shares().sum(0) / max(1, (~batch.stalled).sum())).round(4).tolist()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# 编码基准：7 人房间的 GameState，每条消息的编码耗时
+# 用法（在 backend_py 目录下）：python -m bench.codec_bench [--number 2000]
+import argparse
+import json
+import random
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+import codec
+from engine import N_COMPANIES, Game
+from main import Response, Room, RoomStatus
+
+RECIPIENTS = 7
+
+
+def build_room() -> Room:
+    """构造一个进行到一半的 7 人房间"""
+    rng = random.Random(0)
+    players = [f"player{i}" for i in range(RECIPIENTS)]
+    game = Game(players, rng)
+    for p in range(RECIPIENTS):
+        for c in range(N_COMPANIES):
+            for _ in range((p + c) % 4):
+                game._add_share(p, c)
+        game.money[p] = 10 - p
+    for c in range(N_COMPANIES):
+        game.owner[c] = game.leader[c]
+    for _ in range(6):
+        game.market.append(game.deck.pop())
+        game.market_coins.append(rng.randint(0, 3))
+    return Room(
+        room_id="123456",
+        host_player_name=players[0],
+        players=players,
+        status=RoomStatus.active,
+        game=game,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    room = build_room()
+    message = {"type": "room_state", "seq": 42, "data": room}
+    cases = {
+        # 旧路径：send_json 对每个接收者都 model_dump + json.dumps 一次
+        f"legacy send_json x{RECIPIENTS}": lambda: [
+            json.dumps(
+                {"type": "room_state", "data": room.model_dump()},
+                separators=(",", ":"),
+                ensure_ascii=False,
+            )
+            for _ in range(RECIPIENTS)
+        ],
+        "legacy http (jsonable_encoder)": lambda: json.dumps(
+            jsonable_encoder(Response(data=room)), ensure_ascii=False
+        ).encode(),
+    }
+    for name in ("orjson", "msgspec", "pydantic"):
+        try:
+            backend = codec.load_backend(name)
+        except ImportError:
+            print(f"{name:32s} not installed")
+            continue
+        cases[f"{name} broadcast (once)"] = lambda b=backend: b(message)
+    cases[f"codec.dumps http [{codec.BACKEND}]"] = lambda: codec.dumps(Response(data=room))
+
+    size = len(codec.dumps(message))
+    print(f"7-player room_state message: {size} bytes, number={args.number}")
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number
+        print(f"{name:32s} {best * 1e6:9.1f} us/msg")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# 负载基准：本地起服务，N 个房间各 3-7 个模拟玩家通过 HTTP 接口和 WebSocket 打完整局
+# 用法（在 backend_py 目录下，需要 httpx 和 websockets）：
+#   python -m bench.load_bench --rooms 50 --workers 2 [--ws-actions] [--json]
+# 报告动作延迟、广播送达延迟（动作发出到房间里每个连接收到）的 p50/p99、消息吞吐和每个房间的内存
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+from state_stream import apply_ops
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid: int) -> int:
+    """进程及其所有子进程的 RSS（Linux /proc），拿不到时返回 0"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(c) for c in f.read().split()]
+    except (OSError, StopIteration):
+        return 0
+    return rss + sum(_rss_kb(c) for c in children)
+
+
+def _pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+
+# 合法动作直接用服务端私有消息里的 legal，不在客户端重算规则
+def choose_move(legal: dict, rng: random.Random):
+    """手里有 3 张牌时随机选拿牌或抽牌，返回 (动作, 参数)；无路可走时返回 None"""
+    options = legal["take"]
+    can_draw = legal["can_draw"]
+    if not options and not can_draw:
+        return None
+    if options and (not can_draw or rng.random() < 0.5):
+        return "take", {"card_index": rng.choice(options)}
+    return "draw", {}
+
+
+def choose_play(legal: dict, rng: random.Random) -> dict:
+    company = rng.choice(legal["invest"])
+    invest = company not in legal["to_market"] or rng.random() < 0.6
+    return {"card_company": company, "action": "invest" if invest else "to_market"}
+
+
+class Stats:
+    def __init__(self):
+        self.action_latency: List[float] = []
+        self.broadcast_latency: List[float] = []
+        self.messages = 0
+        self.games_finished = 0
+        self.games_stalled = 0
+        self.errors = 0
+
+
+class Player:
+    """一个模拟玩家：持有 WebSocket，用收到的广播维护自己视角的房间副本"""
+
+    def __init__(self, room: "RoomRun", name: str):
+        self.room = room
+        self.name = name
+        self.ws = None
+        self.state: Optional[dict] = None
+        self.seen_seq = -1
+        # 最近一条私有消息（自己的手牌变化）的序号
+        self.private_seq = -1
+        # 轮到自己时服务端发来的合法动作
+        self.legal: Optional[dict] = None
+        self.changed = asyncio.Event()
+        self.replies: Dict[int, asyncio.Future] = {}
+
+    async def connect(self, base_ws: str):
+        self.ws = await websockets.connect(
+            f"{base_ws}/{self.room.room_id}/{self.name}?token={self.room.tokens[self.name]}",
+            max_size=None,
+        )
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        stats = self.room.stats
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter()
+                stats.messages += 1
+                message = json.loads(raw)
+                kind = message.get("type")
+                if kind == "ping":
+                    await self.ws.send('{"type": "pong"}')
+                    continue
+                if kind in ("ack", "error"):
+                    future = self.replies.pop(message["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                    continue
+                if kind == "action" and self.room.sent_at is not None:
+                    stats.broadcast_latency.append(now - self.room.sent_at)
+                self.on_message(message)
+                self.changed.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    def on_message(self, message: dict):
+        kind = message.get("type")
+        if kind in ("room_state", "game_started"):
+            self.state = message["data"]
+        elif kind in ("action", "private"):
+            apply_ops(self.state, message.get("ops", []))
+        if kind == "private":
+            self.private_seq = message["seq"]
+            self.legal = message.get("legal")
+        elif "seq" in message:
+            self.seen_seq = max(self.seen_seq, message["seq"])
+
+    async def wait_seq(self, seq: int, private: bool = False):
+        """等到收到序号 seq 的广播；private=True 时还要等到同一序号的私有消息"""
+        while self.seen_seq < seq or (private and self.private_seq < seq):
+            self.changed.clear()
+            await self.changed.wait()
+
+
+class RoomRun:
+    def __init__(self, index: int, players: int, stats: Stats, rng: random.Random):
+        self.names = [f"r{index}p{i}" for i in range(players)]
+        self.stats = stats
+        self.rng = rng
+        self.room_id = ""
+        self.tokens: Dict[str, str] = {}
+        self.players: List[Player] = []
+        self.host: Optional[Player] = None
+        self.sent_at: Optional[float] = None
+        self.next_id = 0
+
+    async def setup(self, client: httpx.AsyncClient, base_ws: str):
+        r = await client.post("/room/create", params={"host_player_name": self.names[0]})
+        data = r.json()["data"]
+        self.room_id = data["room_id"]
+        self.tokens[self.names[0]] = data["token"]
+        for name in self.names[1:]:
+            r = await client.post(
+                "/room/join", params={"room_id": self.room_id, "player_name": name}
+            )
+            self.tokens[name] = r.json()["data"]["token"]
+        self.players = [Player(self, name) for name in self.names]
+        self.host = self.players[0]
+        for player in self.players:
+            await player.connect(base_ws)
+
+    async def start(self, client: httpx.AsyncClient):
+        r = await client.post(
+            "/room/start", params={"room_id": self.room_id, "token": self.tokens[self.names[0]]}
+        )
+        if r.status_code != 200:
+            raise RuntimeError(r.text)
+        # 开局是房间的第一个补丁，seq 为 1；每个人随后收到自己的手牌
+        await asyncio.gather(*(p.wait_seq(1, private=True) for p in self.players))
+
+    async def _act(
+        self, client: httpx.AsyncClient, player: str, action: str, params: dict, ws: bool
+    ):
+        self.sent_at = start = time.perf_counter()
+        mover = self.players[self.names.index(player)]
+        if ws:
+            self.next_id += 1
+            future = asyncio.get_running_loop().create_future()
+            mover.replies[self.next_id] = future
+            payload = {"type": "action", "id": self.next_id, **params, "action": action}
+            if action == "play":
+                payload["play_type"] = params["action"]
+            await mover.ws.send(json.dumps(payload))
+            reply = await future
+            ok, seq = reply["type"] == "ack", reply.get("seq")
+        else:
+            r = await client.post(
+                f"/room/action/{action}",
+                params={
+                    "room_id": self.room_id,
+                    "token": self.tokens[player],
+                    "delta": "true",
+                    **params,
+                },
+            )
+            ok = r.status_code == 200
+            seq = r.json()["data"]["seq"] if ok else None
+        self.stats.action_latency.append(time.perf_counter() - start)
+        if not ok:
+            self.stats.errors += 1
+            return False
+        # 等房间里每个连接都收到这条广播再走下一步，送达延迟才不会互相干扰；
+        # 动作的人还会收到自己手牌的变化，回合结束时每个人都会收到新的手牌
+        await asyncio.gather(*(p.wait_seq(seq) for p in self.players))
+        round_number = self.host.state["game_state"]["round_number"]
+        if round_number != self.round_number:
+            self.round_number = round_number
+            await asyncio.gather(*(p.wait_seq(seq, private=True) for p in self.players))
+        else:
+            await mover.wait_seq(seq, private=True)
+        # 下一个轮到的人会收到带合法动作的私有消息
+        if self.host.state["status"] != "finished":
+            current = self.host.state["game_state"]["current_player_id"]
+            await self.players[self.names.index(current)].wait_seq(seq, private=True)
+        self.sent_at = None
+        return True
+
+    async def play(self, client: httpx.AsyncClient, ws: bool):
+        self.round_number = self.host.state["game_state"]["round_number"]
+        while self.host.state["status"] != "finished":
+            player = self.host.state["game_state"]["current_player_id"]
+            mover = self.players[self.names.index(player)]
+            if mover.legal["phase"] == "take":
+                move = choose_move(mover.legal, self.rng)
+                if move is None:
+                    self.stats.games_stalled += 1
+                    return
+                if not await self._act(client, player, *move, ws):
+                    return
+            params = choose_play(mover.legal, self.rng)
+            if not await self._act(client, player, "play", params, ws):
+                return
+        self.stats.games_finished += 1
+
+    async def close(self):
+        for p in self.players:
+            await p.ws.close()
+
+
+async def run_load(base: str, args) -> dict:
+    stats = Stats()
+    rng = random.Random(args.seed)
+    base_ws = base.replace("http://", "ws://")
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30) as client:
+        runs = [
+            RoomRun(i, rng.randint(args.min_players, args.max_players), stats, rng)
+            for i in range(args.rooms)
+        ]
+        rss_before = _rss_kb(args.server_pid)
+        for run in runs:
+            await run.setup(client, base_ws)
+        await asyncio.gather(*(run.start(client) for run in runs))
+        rss_rooms = _rss_kb(args.server_pid)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run.play(client, args.ws_actions) for run in runs))
+        elapsed = time.perf_counter() - start
+        for run in runs:
+            await run.close()
+
+    return {
+        "rooms": args.rooms,
+        "players": sum(len(r.names) for r in runs),
+        "workers": args.workers,
+        "transport": "websocket" if args.ws_actions else "http",
+        "seconds": round(elapsed, 3),
+        "actions": len(stats.action_latency),
+        "actions_per_sec": round(len(stats.action_latency) / elapsed, 1),
+        "action_p50_ms": _pct(stats.action_latency, 0.5),
+        "action_p99_ms": _pct(stats.action_latency, 0.99),
+        "broadcast_p50_ms": _pct(stats.broadcast_latency, 0.5),
+        "broadcast_p99_ms": _pct(stats.broadcast_latency, 0.99),
+        "messages": stats.messages,
+        "messages_per_sec": round(stats.messages / elapsed, 1),
+        "memory_per_room_kb": (
+            round((rss_rooms - rss_before) / args.rooms, 1) if rss_before else None
+        ),
+        "games_finished": stats.games_finished,
+        "games_stalled": stats.games_stalled,
+        "errors": stats.errors,
+    }
+
+
+def _start_server(args, port: int) -> subprocess.Popen:
+    # 所有模拟玩家都从本机连接，不限每个 IP 的连接数
+    env = dict(os.environ, STARTUPS_DB="", STARTUPS_MAX_CONNECTIONS_PER_IP="0")
+    if args.workers > 1:
+        cmd = [
+            sys.executable, "-m", "cluster",
+            "--workers", str(args.workers),
+            "--port", str(port),
+            "--runtime-dir", tempfile.mkdtemp(prefix="startups-bench-"),
+        ]
+    else:
+        cmd = [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port), "--log-level", "warning",
+        ]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("server did not start")
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Startups 负载基准")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--min-players", type=int, default=3)
+    parser.add_argument("--max-players", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=100, help="HTTP 连接池大小")
+    parser.add_argument("--ws-actions", action="store_true", help="动作走 WebSocket 而不是 HTTP")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="压测已经在运行的服务，不在本地启动")
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        base = args.url.rstrip("/")
+        args.server_pid = 0
+    else:
+        port = _free_port()
+        proc = _start_server(args, port)
+        base = f"http://127.0.0.1:{port}"
+        args.server_pid = proc.pid
+    try:
+        report = asyncio.run(run_load(base, args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    for key, value in report.items():
+        print(f"{key:20s} {value}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,101 @@
+# 冷启动基准：从启动进程到第一个 WebSocket 连接被接受要多久
+# 用法（在 backend_py 目录下，需要 websockets）：
+#   python -m bench.startup_bench [--modes production,dev,cluster,cluster-no-preload] [--runs 5] [--json]
+# 每种启动方式跑 runs 次，报告最小值和中位数；按需扩容时新机器多久能接客就看这个数。
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import websockets
+
+from bench.load_bench import _free_port
+
+MODES = ("production", "dev", "cluster", "cluster-no-preload")
+
+
+def _command(mode: str, port: int, workers: int) -> List[str]:
+    if mode == "production":
+        return [sys.executable, "main.py", "--production", "--port", str(port)]
+    if mode == "dev":
+        return [sys.executable, "main.py", "--port", str(port)]
+    cmd = [
+        sys.executable, "-m", "cluster",
+        "--workers", str(workers),
+        "--port", str(port),
+        "--runtime-dir", tempfile.mkdtemp(prefix="startups-bench-"),
+    ]
+    if mode == "cluster-no-preload":
+        cmd.append("--no-preload")
+    return cmd
+
+
+async def _first_accept(url: str, deadline: float) -> bool:
+    """不停地尝试连接，直到握手成功"""
+    while time.perf_counter() < deadline:
+        try:
+            async with websockets.connect(url, open_timeout=1):
+                return True
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+            await asyncio.sleep(0.005)
+    return False
+
+
+def measure(mode: str, workers: int, timeout: float) -> float:
+    """一次冷启动的秒数"""
+    port = _free_port()
+    env = dict(os.environ, STARTUPS_DB="")
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        _command(mode, port, workers),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        ok = asyncio.run(_first_accept(f"ws://127.0.0.1:{port}/lobby", start + timeout))
+        elapsed = time.perf_counter() - start
+    finally:
+        # 重载模式和集群都会再起子进程，整个进程组一起结束
+        os.killpg(proc.pid, 15)
+        proc.wait()
+    if not ok:
+        raise SystemExit(f"{mode}: no websocket accepted within {timeout}s")
+    return elapsed
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Startups 冷启动基准")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2, help="cluster 模式的 worker 数")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    report: Dict[str, dict] = {}
+    for mode in args.modes.split(","):
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}, choose from {', '.join(MODES)}")
+        times = [measure(mode, args.workers, args.timeout) for _ in range(args.runs)]
+        report[mode] = {
+            "min_ms": round(min(times) * 1000, 1),
+            "median_ms": round(statistics.median(times) * 1000, 1),
+        }
+    if args.json:
+        print(json.dumps({"runs": args.runs, "workers": args.workers, "modes": report}))
+        return
+    print(f"time to first accepted websocket ({args.runs} runs, cluster workers={args.workers})")
+    for mode, result in report.items():
+        print(f"  {mode:20} min {result['min_ms']:8.1f} ms   median {result['median_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,94 @@
+# 持久化基准：每个动作的写入延迟和重启恢复时间
+# 用法（在 backend_py 目录下）：python -m bench.storage_bench [--rooms 500] [--moves 60]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import main
+from engine import HAND_SIZE, COMPANIES
+from sim import RandomPolicy, can_draw, playable, takable
+from storage import RoomStore
+
+
+def play_moves(room: main.Room, moves: int, policy: RandomPolicy):
+    """用随机策略走 moves 个回合，每个动作都写日志"""
+    game = room.game
+    for _ in range(moves):
+        if game.status == "game_over":
+            return
+        seat = game.current
+        player = game.player_ids[seat]
+        if len(game.hands[seat]) == HAND_SIZE:
+            options = takable(game, seat)
+            if not options and not can_draw(game, seat):
+                return
+            index = policy.choose_take(game, seat, options)
+            if index is None:
+                game.draw(seat)
+                main._log(room, "draw", {"player": player})
+            else:
+                game.take(seat, index)
+                main._log(room, "take", {"player": player, "index": index})
+        company, invest = policy.choose_play(game, seat, playable(game, seat))
+        game.play(seat, company, invest)
+        main._finish_if_over(room)
+        main._log(
+            room, "play", {"player": player, "company": COMPANIES[company], "invest": invest}
+        )
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument("--moves", type=int, default=60)
+    parser.add_argument("--snapshot-every", type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    main.store = RoomStore(path, args.snapshot_every)
+    policy = RandomPolicy(random.Random(0))
+    for i in range(args.rooms):
+        room_id = f"{i:06d}"
+        players = [f"p{j}" for j in range(args.players)]
+        room = main.Room(
+            room_id=room_id,
+            host_player_name=players[0],
+            players=[players[0]],
+            status=main.RoomStatus.waiting,
+        )
+        token = main.sessions.issue(room_id)
+        main._log(room, "create", {"room_id": room_id, "host": players[0], "token": token})
+        for p in players[1:]:
+            room.players.append(p)
+            main._log(room, "join", {"player": p, "token": main.sessions.issue(room_id)})
+        room.game = main.Game(room.players)
+        room.status = main.RoomStatus.active
+        main._log(room, "start", {"seed": room.game.seed})
+        play_moves(room, args.moves, policy)
+        main.rooms[room_id] = room
+    expected = {rid: main._room_snapshot(r) for rid, r in main.rooms.items()}
+    stats = main.store.stats()
+    main.store.close()
+
+    # 模拟重启
+    main.rooms.clear()
+    main.store = RoomStore(path, args.snapshot_every)
+    start = time.perf_counter()
+    main._recover()
+    elapsed = time.perf_counter() - start
+    recovered = {rid: main._room_snapshot(r) for rid, r in main.rooms.items()}
+    assert recovered == expected, "recovered rooms differ"
+
+    print(f"rooms               {args.rooms}")
+    print(f"writes              {stats['writes']}")
+    print(f"write p50 / p99     {stats['write_p50_us']} / {stats['write_p99_us']} us")
+    print(f"write max           {stats['write_max_us']} us")
+    print(f"recovery            {elapsed * 1000:.1f} ms ({elapsed / args.rooms * 1e6:.0f} us/room)")
+    print(f"db size             {os.path.getsize(path) // 1024} KB")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from codec import dumps_text
+from metrics import SIZE_BUCKETS, counter, histogram
+
+FANOUT = histogram(
+    "startups_broadcast_fanout", "本 worker 上收到一条房间广播的连接数", buckets=SIZE_BUCKETS
+)
+DROPPED = counter("startups_dropped_sends_total", "没有送出的消息", ("reason",))
+
+# 连接编号：进程号加自增数，多 worker 时也不会重复
+_conn_ids = itertools.count()
+
+
+def player_channel(room_id: str, player: str) -> str:
+    """只发给房间里某个玩家的消息（例如自己的手牌）走的频道"""
+    return f"{room_id}/{player}"
+
+
+# ====== 单个连接的发送端 ======
+class Connection:
+    """每个 WebSocket 一个有界发送队列和一个独立的写任务
+
+    慢客户端只会塞满自己的队列，不会拖慢同房间的其他连接；
+    队列满了说明它已经落后太多，直接断开，让它重连后拿快照。
+    channels 是它登记过的所有频道，摘除时一起摘掉。
+    """
+
+    __slots__ = ("id", "websocket", "viewer", "channels", "queue", "task", "closed")
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_queue: int,
+        viewer: Optional[str] = None,
+        channels: Tuple[str, ...] = (),
+    ):
+        self.id = f"{os.getpid()}-{next(_conn_ids)}"
+        self.websocket = websocket
+        self.viewer = viewer
+        self.channels = channels
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, text: str) -> bool:
+        """非阻塞入队，队列已满返回 False"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            DROPPED.inc(reason="queue_full")
+            return False
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                if isinstance(text, tuple):
+                    # shutdown() 放入的关闭标记：前面的消息都发完了再关
+                    self.closed = True
+                    await self._close_socket(*text)
+                    return
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 发送失败，连接已经不可用
+            self.closed = True
+            DROPPED.inc(reason="send_failed")
+
+    def shutdown(self, code: int, reason: str = ""):
+        """发完已经排队的消息后关闭连接；队列满时直接关闭"""
+        try:
+            self.queue.put_nowait((code, reason))
+        except asyncio.QueueFull:
+            self.close(code, reason)
+
+    def close(self, code: Optional[int] = None, reason: str = ""):
+        """停止写任务；给定 code 时顺带关闭底层连接"""
+        if self.closed and self.task.done():
+            return
+        self.closed = True
+        self.task.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+
+# ====== 房间广播器 ======
+class Broadcaster:
+    """按房间管理连接：每条消息只编码一次，再分发到各连接的队列"""
+
+    def __init__(self, max_queue: int = 64):
+        self.max_queue = max_queue
+        # room_id -> {WebSocket: Connection}
+        self.connections: Dict[str, Dict[WebSocket, Connection]] = {}
+
+    def add(self, room_id: str, websocket: WebSocket, viewer: Optional[str] = None) -> Connection:
+        """viewer 为玩家名时，连接同时登记在该玩家的私有频道上"""
+        channels = (room_id,) if viewer is None else (room_id, player_channel(room_id, viewer))
+        conn = Connection(websocket, self.max_queue, viewer, channels)
+        for channel in channels:
+            self.connections.setdefault(channel, {})[websocket] = conn
+        return conn
+
+    def _discard(self, channel: str, websocket: WebSocket) -> Optional[Connection]:
+        conns = self.connections.get(channel)
+        if not conns:
+            return None
+        conn = conns.pop(websocket, None)
+        if not conns:
+            del self.connections[channel]
+        return conn
+
+    def _unregister(self, websocket: WebSocket, conn: Connection):
+        """从连接登记过的所有频道上摘掉"""
+        for channel in conn.channels:
+            self._discard(channel, websocket)
+
+    def remove(self, room_id: str, websocket: WebSocket):
+        conn = self.connections.get(room_id, {}).get(websocket)
+        if conn is None:
+            # 已经因为跟不上被摘掉了（所有频道一起）
+            return
+        self._unregister(websocket, conn)
+        conn.close()
+
+    def count(self) -> int:
+        """连接数，同一连接登记在多个频道上只算一次"""
+        return len({id(conn) for conns in self.connections.values() for conn in conns.values()})
+
+    def replace(self, room_id: str, viewer: str, keep: str, code: int, reason: str = "") -> int:
+        """同一玩家在房间里只保留编号为 keep 的连接，其余的发完手头的消息后关闭"""
+        old = [
+            (ws, conn)
+            for ws, conn in self.connections.get(player_channel(room_id, viewer), {}).items()
+            if conn.id != keep
+        ]
+        for ws, conn in old:
+            self._unregister(ws, conn)
+            conn.shutdown(code, reason)
+        return len(old)
+
+    def ping(self, text: str) -> int:
+        """心跳：每个连接发一次 text；队列已满的连接已经跟不上，断开，返回断开的数量"""
+        seen: Set[int] = set()
+        lagging: List[Tuple[WebSocket, Connection]] = []
+        for conns in self.connections.values():
+            for ws, conn in conns.items():
+                if id(conn) in seen:
+                    continue
+                seen.add(id(conn))
+                if not conn.offer(text):
+                    lagging.append((ws, conn))
+        self._drop_lagging(lagging)
+        return len(lagging)
+
+    def _drop_lagging(self, lagging: List[Tuple[WebSocket, Connection]]):
+        """跟不上的连接从所有频道上摘掉再断开（一个连接可能登记在房间和玩家两个频道上）"""
+        for ws, conn in lagging:
+            self._unregister(ws, conn)
+            # 1013: Try Again Later，客户端重连后会拿到快照
+            conn.close(code=1013, reason="Too far behind")
+
+    def close_room(self, room_id: str, code: int = 1001, reason: str = ""):
+        """房间被回收：每个连接发完手头的消息后关闭"""
+        for websocket, conn in list(self.connections.get(room_id, {}).items()):
+            self._unregister(websocket, conn)
+            conn.shutdown(code, reason)
+
+    def send(self, conn: Connection, message: dict) -> bool:
+        """只发给一个连接（例如新连接的快照），与广播共用同一个队列保证顺序"""
+        return conn.offer(dumps_text(message))
+
+    def publish_text(self, room_id: str, text: str) -> int:
+        """向房间内所有连接广播已经编码好的消息（都经总线转来），返回成功入队的连接数"""
+        room_conns = self.connections.get(room_id)
+        if not room_conns:
+            return 0
+        FANOUT.observe(len(room_conns))
+        delivered = 0
+        lagging = []
+        for ws, conn in room_conns.items():
+            if conn.offer(text):
+                delivered += 1
+            else:
+                lagging.append((ws, conn))
+        self._drop_lagging(lagging)
+        return delivered
+
+
+# ====== 连接数上限 ======
+class ConnectionLimiter:
+    """本 worker 的连接总数上限和每个客户端 IP 的上限，0 表示不限
+
+    在 accept 之前检查，超限的连接直接拒绝，连接表的内存和广播扇出都有上界。
+    """
+
+    def __init__(self, max_total: int = 0, max_per_ip: int = 0):
+        self.max_total = max_total
+        self.max_per_ip = max_per_ip
+        self.total = 0
+        self.by_ip: Dict[str, int] = {}
+
+    def acquire(self, ip: str) -> Optional[str]:
+        """占用一个名额；超限时返回超出的是哪个上限（"total" / "ip"）"""
+        if self.max_total and self.total >= self.max_total:
+            return "total"
+        count = self.by_ip.get(ip, 0)
+        if self.max_per_ip and count >= self.max_per_ip:
+            return "ip"
+        self.total += 1
+        self.by_ip[ip] = count + 1
+        return None
+
+    def release(self, ip: str):
+        self.total -= 1
+        count = self.by_ip[ip] - 1
+        if count:
+            self.by_ip[ip] = count
+        else:
+            del self.by_ip[ip]
@@ -0,0 +1,571 @@
+# 多进程分片：按 room_id 的一致性哈希把房间分给各个 worker 进程
+#   - HTTP 请求由 ShardRouter 转发到房间所在的 worker（经 Unix socket）
+#   - broadcast_to_room 经 PubSub 总线投递，WebSocket 连在哪个 worker 上都能收到
+# 启动（在 backend_py 目录下）：python -m cluster --workers 4 --port 8080
+import argparse
+import asyncio
+import bisect
+import hashlib
+import heapq
+import importlib
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+FORWARDED_HEADER = "x-startups-forwarded"
+# 转发头的值：代客户端转发的请求为 1，worker 自己发起的内部查询为 internal
+INTERNAL = "internal"
+_HOP_HEADERS = {b"host", b"content-length", b"connection", b"transfer-encoding"}
+
+
+# ====== 一致性哈希 ======
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环，增减 worker 时只有少量房间换主"""
+
+    def __init__(self, shards: int, vnodes: int = 64):
+        points = sorted(
+            (_hash(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes)
+        )
+        self._keys = [k for k, _ in points]
+        self._shards = [s for _, s in points]
+
+    def owner(self, room_id: str) -> int:
+        i = bisect.bisect(self._keys, _hash(room_id)) % len(self._keys)
+        return self._shards[i]
+
+
+# ====== 集群配置 ======
+class ClusterConfig:
+    """当前 worker 的分片信息，来自环境变量
+
+    STARTUPS_SHARD / STARTUPS_SHARDS  本进程的分片号和分片总数
+    STARTUPS_CLUSTER_DIR              各 worker 的 Unix socket 和总线 socket 所在目录
+    STARTUPS_PUBSUB                   local（单进程）或 unix
+    """
+
+    def __init__(self, shard: int = 0, shards: int = 1, runtime_dir: str = "", pubsub: str = "local"):
+        self.shard = shard
+        self.shards = shards
+        self.runtime_dir = runtime_dir
+        self.pubsub = pubsub
+        self.ring = HashRing(shards)
+
+    @classmethod
+    def from_env(cls) -> "ClusterConfig":
+        shards = int(os.environ.get("STARTUPS_SHARDS", "1"))
+        return cls(
+            shard=int(os.environ.get("STARTUPS_SHARD", "0")),
+            shards=shards,
+            runtime_dir=os.environ.get("STARTUPS_CLUSTER_DIR", ""),
+            pubsub=os.environ.get("STARTUPS_PUBSUB", "unix" if shards > 1 else "local"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.shards > 1
+
+    def owner(self, room_id: str) -> int:
+        return self.ring.owner(room_id) if self.enabled else 0
+
+    def owns(self, room_id: str) -> bool:
+        return self.owner(room_id) == self.shard
+
+    def socket_path(self, shard: int) -> str:
+        return os.path.join(self.runtime_dir, f"shard-{shard}.sock")
+
+    @property
+    def bus_path(self) -> str:
+        return os.path.join(self.runtime_dir, "bus.sock")
+
+    def db_path(self, path: str) -> str:
+        """每个分片一个数据库文件"""
+        if not self.enabled or not path:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}-{self.shard}{ext}"
+
+    def make_bus(self, handler: "Handler") -> "PubSub":
+        if self.pubsub == "unix":
+            return UnixSocketPubSub(handler, self.bus_path)
+        return LocalPubSub(handler)
+
+
+# ====== 发布/订阅总线 ======
+Handler = Callable[[str, str], None]
+
+
+class PubSub:
+    """房间广播总线：publish 的消息投递给所有订阅了该频道的 worker
+
+    handler(channel, text) 在收到消息的 worker 上调用，text 是已经编码好的 JSON。
+    """
+
+    def __init__(self, handler: Handler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    def subscribe(self, channel: str):
+        pass
+
+    def unsubscribe(self, channel: str):
+        pass
+
+    def publish(self, channel: str, text: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalPubSub(PubSub):
+    """单进程：直接回调"""
+
+    def publish(self, channel: str, text: str):
+        self.handler(channel, text)
+
+
+# 帧格式：4 字节长度 + 1 字节操作（P 发布 / S 订阅 / U 退订）+ 2 字节频道长度 + 频道 + 负载
+def _frame(op: bytes, channel: str, payload: bytes = b"") -> bytes:
+    ch = channel.encode()
+    body = op + struct.pack(">H", len(ch)) + ch + payload
+    return struct.pack(">I", len(body)) + body
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[bytes, str, bytes]:
+    (size,) = struct.unpack(">I", await reader.readexactly(4))
+    body = await reader.readexactly(size)
+    (ch_len,) = struct.unpack(">H", body[1:3])
+    return body[:1], body[3 : 3 + ch_len].decode(), body[3 + ch_len :]
+
+
+class UnixSocketPubSub(PubSub):
+    """多进程：所有 worker 连到同一个总线进程（run_hub），总线按订阅转发
+
+    本地订阅者直接回调，不经过总线绕一圈。
+    """
+
+    def __init__(self, handler: Handler, path: str):
+        super().__init__(handler)
+        self.path = path
+        self.channels: Set[str] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                op, channel, payload = await _read_frame(reader)
+                if op == b"P" and channel in self.channels:
+                    self.handler(channel, payload.decode())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def subscribe(self, channel: str):
+        if channel not in self.channels:
+            self.channels.add(channel)
+            self._writer.write(_frame(b"S", channel))
+
+    def unsubscribe(self, channel: str):
+        if channel in self.channels:
+            self.channels.discard(channel)
+            self._writer.write(_frame(b"U", channel))
+
+    def publish(self, channel: str, text: str):
+        if channel in self.channels:
+            self.handler(channel, text)
+        self._writer.write(_frame(b"P", channel, text.encode()))
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+async def run_hub(path: str):
+    """总线进程：记录每个 worker 订阅的频道，把发布的消息转给其他订阅者"""
+    subscribers: Dict[str, Set[asyncio.StreamWriter]] = {}
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        mine: Set[str] = set()
+        try:
+            while True:
+                op, channel, payload = await _read_frame(reader)
+                if op == b"S":
+                    mine.add(channel)
+                    subscribers.setdefault(channel, set()).add(writer)
+                elif op == b"U":
+                    mine.discard(channel)
+                    subscribers.get(channel, set()).discard(writer)
+                elif op == b"P":
+                    frame = _frame(b"P", channel, payload)
+                    for peer in subscribers.get(channel, ()):
+                        if peer is not writer:
+                            peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in mine:
+                subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(serve, path)
+    async with server:
+        await server.serve_forever()
+
+
+# ====== 请求转发 ======
+async def forward_http(
+    socket_path: str,
+    method: str,
+    target: str,
+    headers: List[Tuple[bytes, bytes]],
+    body: bytes = b"",
+    internal: bool = False,
+) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """经 Unix socket 向另一个 worker 发一个 HTTP/1.1 请求，返回 (status, headers, body)
+
+    internal=True 表示 worker 自己发起的查询，只有这种请求能用内部接口。
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    lines = [
+        f"{method} {target} HTTP/1.1",
+        "host: shard",
+        f"content-length: {len(body)}",
+        "connection: close",
+        f"{FORWARDED_HEADER}: {INTERNAL if internal else 1}",
+    ]
+    for key, value in headers:
+        if key.lower() not in _HOP_HEADERS and key.lower() != FORWARDED_HEADER.encode():
+            lines.append(f"{key.decode('latin-1')}: {value.decode('latin-1')}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.split(b"\r\n")
+    status = int(status_line.split()[1])
+    resp_headers = []
+    chunked = False
+    for line in header_lines:
+        key, _, value = line.partition(b":")
+        key, value = key.strip().lower(), value.strip()
+        if key == b"transfer-encoding" and value == b"chunked":
+            chunked = True
+        if key not in _HOP_HEADERS:
+            resp_headers.append((key, value))
+    if chunked:
+        payload = _dechunk(payload)
+    resp_headers.append((b"content-length", str(len(payload)).encode()))
+    return status, resp_headers, payload
+
+
+def _dechunk(data: bytes) -> bytes:
+    out = bytearray()
+    while data:
+        size_line, _, data = data.partition(b"\r\n")
+        size = int(size_line.split(b";")[0], 16)
+        if size == 0:
+            break
+        out += data[:size]
+        data = data[size + 2 :]
+    return bytes(out)
+
+
+def _forwarded_as(scope) -> Optional[bytes]:
+    """转发头的值；只认从 Unix socket 进来的请求（没有本地地址，scope["server"] 为 None），
+    客户端在 TCP 上伪造的转发头不算数"""
+    if scope.get("server") is not None:
+        return None
+    for key, value in scope["headers"]:
+        if key == FORWARDED_HEADER.encode():
+            return value
+    return None
+
+
+def is_forwarded(scope) -> bool:
+    """请求是否由其他 worker 转发而来"""
+    return _forwarded_as(scope) is not None
+
+
+def is_internal(scope) -> bool:
+    """请求是否是其他 worker 自己发起的内部查询，代客户端转发的请求不算"""
+    return _forwarded_as(scope) == INTERNAL.encode()
+
+
+def room_id_of(path: str, query_string: bytes) -> Optional[str]:
+    """从请求里找出房间号：查询参数 room_id，或者 /room/{room_id}[/...]"""
+    room_ids = parse_qs(query_string.decode("latin-1")).get("room_id")
+    if room_ids:
+        return room_ids[0]
+    parts = path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] == "room" and parts[1] not in ("create", "list", "action"):
+        return parts[1]
+    return None
+
+
+class ShardRouter:
+    """ASGI 中间件：房间不归本 worker 时把 HTTP 请求转发给房间所在的 worker
+
+    /room/list 向所有分片汇总；已经被转发过的请求一律本地处理，避免来回转发。
+    """
+
+    def __init__(self, app, cluster: ClusterConfig):
+        self.app = app
+        self.cluster = cluster
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or is_forwarded(scope):
+            return await self.app(scope, receive, send)
+
+        if scope["path"] == "/room/list":
+            return await self._gather_list(scope, send)
+        if scope["path"] == "/metrics":
+            return await self._gather_metrics(scope, send)
+
+        shard = _shard_param(scope["query_string"])
+        if shard is not None and shard >= self.cluster.shards:
+            shard = None
+        if shard is None:
+            room_id = room_id_of(scope["path"], scope["query_string"])
+            if room_id is not None:
+                shard = self.cluster.owner(room_id)
+        if shard is None or shard == self.cluster.shard:
+            return await self.app(scope, receive, send)
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        status, headers, payload = await forward_http(
+            self.cluster.socket_path(shard),
+            scope["method"],
+            _target(scope),
+            scope["headers"],
+            body,
+        )
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _gather_list(self, scope, send):
+        results = await asyncio.gather(
+            *(
+                forward_http(self.cluster.socket_path(s), "GET", _target(scope), scope["headers"])
+                for s in range(self.cluster.shards)
+            )
+        )
+        for status, headers, payload in results:
+            if status != 200:
+                # 参数错误等，各分片的结果相同，原样返回一个
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await send({"type": "http.response.body", "body": payload})
+                return
+        # 每个分片已经按 cursor 排好序并各取了 limit 条，归并后再截断
+        limits = parse_qs(scope["query_string"].decode("latin-1")).get("limit", ["50"])
+        pages = [json.loads(payload)["data"] for _, _, payload in results]
+        data = list(heapq.merge(*pages, key=lambda entry: entry["cursor"]))[: int(limits[0])]
+        body = json.dumps(
+            {"code": 200, "message": "success", "data": data}, ensure_ascii=False
+        ).encode()
+        await _respond(send, b"application/json", body)
+
+    async def _gather_metrics(self, scope, send):
+        results = await asyncio.gather(
+            *(
+                forward_http(self.cluster.socket_path(s), "GET", "/metrics", [])
+                for s in range(self.cluster.shards)
+            )
+        )
+        body = merge_metrics(
+            [payload.decode() for status, _, payload in results if status == 200]
+        )
+        await _respond(send, b"text/plain; version=0.0.4", body.encode())
+
+
+async def _respond(send, content_type: bytes, body: bytes):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def merge_metrics(texts: List[str]) -> str:
+    """合并各 worker 的 Prometheus 输出，同名指标的样本放在同一组 HELP/TYPE 下"""
+    families: Dict[str, List[str]] = {}
+    name = ""
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split()[2]
+                families.setdefault(name, [line])
+            elif line.startswith("# TYPE "):
+                if len(families[name]) == 1:
+                    families[name].append(line)
+            elif line:
+                families[name].append(line)
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+def _shard_param(query_string: bytes) -> Optional[int]:
+    """?shard=N 指定由哪个 worker 处理，例如查看某个 worker 的 /metrics/profile"""
+    shards = parse_qs(query_string.decode("latin-1")).get("shard")
+    return int(shards[0]) if shards and shards[0].isdigit() else None
+
+
+def _target(scope) -> str:
+    query = scope["query_string"].decode("latin-1")
+    return scope["raw_path"].decode("latin-1") + (f"?{query}" if query else "")
+
+
+async def fetch_json(cluster: ClusterConfig, room_id: str, path: str) -> Optional[dict]:
+    """向房间所在的 worker 取一个 JSON 接口的 data 字段"""
+    status, _, payload = await forward_http(
+        cluster.socket_path(cluster.owner(room_id)), "GET", path, [], internal=True
+    )
+    if status != 200:
+        return None
+    return json.loads(payload)["data"]
+
+
+async def fetch_all(cluster: ClusterConfig, path: str) -> List[Optional[dict]]:
+    """向每个 worker（包括自己）取同一个 JSON 接口的 data 字段，按分片号排列"""
+    results = await asyncio.gather(
+        *(
+            forward_http(cluster.socket_path(s), "GET", path, [], internal=True)
+            for s in range(cluster.shards)
+        )
+    )
+    return [
+        json.loads(payload)["data"] if status == 200 else None
+        for status, _, payload in results
+    ]
+
+
+# ====== 启动器 ======
+# 每个 worker 导入框架要一秒多（大头是 FastAPI 的 OpenAPI 模型），单核机器上 N 个 worker 就是 N 倍。
+# 启动器在 fork 之前先把这些与分片无关的模块导入一次，worker 直接继承；
+# main 本身读取分片环境变量，仍然在各个 worker 里导入。
+PRELOAD_MODULES = (
+    "fastapi",
+    "fastapi.routing",
+    "pydantic",
+    "starlette.middleware.cors",
+    "uvicorn",
+    "uvicorn.config",
+    "uvicorn.server",
+    "sqlite3",
+)
+
+
+def preload(start_method: str) -> bool:
+    """fork 启动时预先导入 PRELOAD_MODULES；spawn 的子进程不继承，跳过"""
+    if start_method != "fork":
+        return False
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    return True
+
+
+def _run_worker(shard: int, shards: int, runtime_dir: str, host: str, port: int):
+    import uvicorn
+
+    os.environ.update(
+        STARTUPS_SHARD=str(shard),
+        STARTUPS_SHARDS=str(shards),
+        STARTUPS_CLUSTER_DIR=runtime_dir,
+    )
+    # 显式指定 IPPROTO_TCP：asyncio 只对 proto 为 TCP 的连接打开 TCP_NODELAY
+    tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # 所有 worker 监听同一个端口，由内核分配连接
+    tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    tcp.bind((host, port))
+    path = os.path.join(runtime_dir, f"shard-{shard}.sock")
+    if os.path.exists(path):
+        os.unlink(path)
+    unix = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    unix.bind(path)
+    server = uvicorn.Server(uvicorn.Config("main:app", log_level="warning"))
+    server.run(sockets=[tcp, unix])
+
+
+def _run_hub(path: str):
+    asyncio.run(run_hub(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多 worker 分片启动器")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--runtime-dir", default="")
+    parser.add_argument(
+        "--no-preload", action="store_true", help="不在启动器里预先导入框架（对比启动时间用）"
+    )
+    args = parser.parse_args()
+    # 只有启动器用到，worker 导入 cluster 时不必付这份开销
+    import multiprocessing
+    import tempfile
+
+    if not args.no_preload:
+        preload(multiprocessing.get_start_method())
+    runtime_dir = args.runtime_dir or tempfile.mkdtemp(prefix="startups-")
+    os.makedirs(runtime_dir, exist_ok=True)
+    bus = os.path.join(runtime_dir, "bus.sock")
+    procs = [multiprocessing.Process(target=_run_hub, args=(bus,), daemon=True)]
+    procs[0].start()
+    while not os.path.exists(bus):
+        if not procs[0].is_alive():
+            raise SystemExit("pub/sub hub failed to start")
+        procs[0].join(0.05)
+    for shard in range(args.workers):
+        p = multiprocessing.Process(
+            target=_run_worker,
+            args=(shard, args.workers, runtime_dir, args.host, args.port),
+        )
+        p.start()
+        procs.append(p)
+    print(f"{args.workers} workers on {args.host}:{args.port}, runtime dir {runtime_dir}")
+    # SIGTERM 和 Ctrl-C 一样，停掉所有 worker 再退出
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for p in procs[1:]:
+            p.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import time
+from typing import Any, Callable
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+from starlette.responses import JSONResponse
+
+from metrics import histogram
+
+# ====== JSON 编码层 ======
+# 所有出站消息（WebSocket 广播和 HTTP 响应）都经过 dumps，每条消息只编码一次。
+# 优先使用 orjson / msgspec，未安装时退回 pydantic-core 自带的 Rust 编码器。
+# 可以用环境变量 STARTUPS_JSON=orjson|msgspec|pydantic 指定后端。
+
+
+def _model_json(model: BaseModel) -> bytes:
+    return model.__pydantic_serializer__.to_json(model)
+
+
+def _pydantic_backend() -> Callable[[Any], bytes]:
+    return to_json
+
+
+def _orjson_backend() -> Callable[[Any], bytes]:
+    import orjson
+
+    fragment = getattr(orjson, "Fragment", None)
+
+    def default(obj):
+        if isinstance(obj, BaseModel):
+            # orjson>=3.9 可以直接嵌入 pydantic 编好的字节
+            if fragment is not None:
+                return fragment(_model_json(obj))
+            return obj.model_dump()
+        raise TypeError
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=default)
+
+    return dumps
+
+
+def _msgspec_backend() -> Callable[[Any], bytes]:
+    import msgspec
+
+    def enc_hook(obj):
+        if isinstance(obj, BaseModel):
+            return msgspec.Raw(_model_json(obj))
+        raise NotImplementedError
+
+    return msgspec.json.Encoder(enc_hook=enc_hook).encode
+
+
+_BACKENDS = {
+    "orjson": _orjson_backend,
+    "msgspec": _msgspec_backend,
+    "pydantic": _pydantic_backend,
+}
+
+
+def load_backend(name: str) -> Callable[[Any], bytes]:
+    return _BACKENDS[name]()
+
+
+def _select_backend():
+    preferred = os.environ.get("STARTUPS_JSON")
+    names = [preferred] if preferred else ["orjson", "msgspec", "pydantic"]
+    for name in names:
+        try:
+            return name, load_backend(name)
+        except (ImportError, KeyError):
+            continue
+    return "pydantic", _pydantic_backend()
+
+
+BACKEND, _dumps = _select_backend()
+
+ENCODE_SECONDS = histogram("startups_encode_seconds", "出站消息的 JSON 编码耗时", ("kind",))
+
+
+def dumps(obj: Any) -> bytes:
+    """把消息编码成 UTF-8 JSON 字节"""
+    if isinstance(obj, BaseModel):
+        return _model_json(obj)
+    return _dumps(obj)
+
+
+def dumps_text(obj: Any) -> str:
+    """WebSocket 文本帧用的编码结果"""
+    start = time.perf_counter()
+    text = dumps(obj).decode()
+    ENCODE_SECONDS.observe(time.perf_counter() - start, kind="ws")
+    return text
+
+
+class FastJSONResponse(JSONResponse):
+    """直接用 dumps 渲染，跳过 jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        start = time.perf_counter()
+        body = dumps(content)
+        ENCODE_SECONDS.observe(time.perf_counter() - start, kind="http")
+        return body
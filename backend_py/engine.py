@@ -0,0 +1,505 @@
+import os
+import random
+import secrets
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from settlement import RoundSettlement
+
+# ====== 常量 ======
+# 公司在引擎内部用 0-5 的小整数表示，对外仍然是 "card5".."card10"
+COMPANIES = ["card5", "card6", "card7", "card8", "card9", "card10"]
+COMPANY_CARD_COUNTS = [5, 6, 7, 8, 9, 10]
+COMPANY_INDEX = {name: i for i, name in enumerate(COMPANIES)}
+N_COMPANIES = len(COMPANIES)
+NO_PLAYER = -1
+
+HAND_SIZE = 3
+START_MONEY = 10
+REMOVED_CARDS = 5
+LAST_ROUND = 2
+
+# 动作记录：每个动作 3 个字节 (操作, 座位, 参数)，参数是拿牌的下标或打出的公司
+OP_DRAW, OP_TAKE, OP_MARKET, OP_INVEST = range(4)
+ACTION_SIZE = 3
+
+
+class RuleError(ValueError):
+    """违反游戏规则的操作，API 层转换成 400"""
+
+
+# 回合结算和整副牌见 settlement，整副牌只在这里生成一次
+SETTLEMENT = RoundSettlement(COMPANY_CARD_COUNTS)
+
+
+def round_rng(seed: int, round_number: int) -> random.Random:
+    """第 round_number 回合洗牌用的随机数流，只由种子和回合数决定"""
+    return random.Random(seed * 16 + round_number)
+
+
+class Legal(NamedTuple):
+    """当前玩家的合法动作；不在进行中的牌局 seat 为 NO_PLAYER，其余字段为空
+
+    手里 3 张牌时可以抽牌或拿牌（take 是可以拿的市场下标），4 张牌时不能再抽或拿；
+    打牌不限手牌数（invest / to_market 是可以投资 / 放到市场的公司），与原来的规则相同。
+    """
+
+    seat: int
+    can_draw: bool
+    draw_cost: int
+    take: Tuple[int, ...]
+    invest: Tuple[int, ...]
+    to_market: Tuple[int, ...]
+
+
+NO_MOVES = Legal(NO_PLAYER, False, 0, (), (), ())
+
+
+# ====== 游戏引擎 ======
+class Game:
+    """紧凑的游戏状态
+
+    玩家用座位号（0..n-1）表示，公司用 0..5 表示：
+      investments  n x 6 的持股矩阵，按行展开的 bytearray
+      hands        每个玩家一个 bytearray，保持拿牌顺序
+      deck         牌库，末尾是牌顶
+      market       市场上的牌，market_coins 是对应牌上的金币
+      owner        每家公司反垄断标记的持有者座位号，NO_PLAYER 表示无人持有
+
+    持股只增不减，所以每家公司的最大持股数 top、达到 top 的人数 top_count
+    和唯一最大股东 leader（并列或无人持股时为 NO_PLAYER）可以在每次加股时 O(1) 维护，
+    反垄断标记交接和回合结算都直接读这份索引。
+    同样增量维护的还有市场上每家公司的牌数 market_counts，以及每个玩家持有反垄断标记的
+    市场牌数 market_owned，抽牌费用因此是 O(1) 的；当前玩家的合法动作 legal() 在状态
+    变化后第一次用到时算一次，动作校验、机器人和 API 共用这一份。
+    每局有一个种子 seed，每回合的洗牌只由 seed 和回合数决定；
+    log 按顺序记下每个成功的动作，seed 加 log 就能重放出任意一步的状态（见 replay）。
+    check_index 打开时每次打牌后都会全量重算并校验索引，供测试使用。
+    """
+
+    check_index = os.environ.get("STARTUPS_CHECK_INDEX") == "1"
+
+    __slots__ = (
+        "game_id",
+        "player_ids",
+        "seats",
+        "hands",
+        "investments",
+        "money",
+        "score",
+        "deck",
+        "removed",
+        "market",
+        "market_coins",
+        "market_counts",
+        "market_owned",
+        "owner",
+        "top",
+        "top_count",
+        "leader",
+        "current",
+        "round_number",
+        "status",
+        "seed",
+        "log",
+        "_legal",
+    )
+
+    def __init__(
+        self, player_ids: List[str], rng: Optional[random.Random] = None, seed: Optional[int] = None
+    ):
+        """seed 不给时从 rng 取一个；也不给 rng 时用 secrets 生成
+
+        种子能推出所有人的手牌，对局结束后还会公开，不能用全局的 Mersenne Twister：
+        看到几局的种子就能推出它的状态，进而算出之后对局的种子。模拟器传入自己的 rng 以便复现。
+        """
+        n = len(player_ids)
+        self.game_id = f"game_{player_ids[0]}"
+        self.player_ids = list(player_ids)
+        self.seats: Dict[str, int] = {pid: i for i, pid in enumerate(player_ids)}
+        if seed is None:
+            seed = secrets.randbits(63) if rng is None else rng.getrandbits(63)
+        self.seed = seed
+        self.log = bytearray()
+
+        deck = SETTLEMENT.deck()
+        round_rng(self.seed, 1).shuffle(deck)
+        self.removed = bytes(deck.pop() for _ in range(REMOVED_CARDS))
+        self.deck = deck
+        self.hands = [bytearray(deck.pop() for _ in range(HAND_SIZE)) for _ in range(n)]
+        self.investments = bytearray(n * N_COMPANIES)
+        self.money = array("i", [START_MONEY] * n)
+        self.score = array("i", [0] * n)
+        self.market = bytearray()
+        self.market_coins = array("i")
+        self.market_counts = bytearray(N_COMPANIES)
+        self.market_owned = array("i", [0] * n)
+        self.owner = array("b", [NO_PLAYER] * N_COMPANIES)
+        self.top = bytearray(N_COMPANIES)
+        self.top_count = bytearray([n] * N_COMPANIES)
+        self.leader = array("b", [NO_PLAYER] * N_COMPANIES)
+        self.current = 0
+        self.round_number = 1
+        self.status = "active"
+        self._legal: Optional[Legal] = None
+
+    # ---- 查询 ----
+    def seat(self, player_id: str) -> int:
+        return self.seats.get(player_id, NO_PLAYER)
+
+    def holding(self, player: int, company: int) -> int:
+        return self.investments[player * N_COMPANIES + company]
+
+    def has_antimonopoly(self, player: int, company: int) -> bool:
+        return self.owner[company] == player
+
+    def draw_cost(self, player: int) -> int:
+        """市场上每张自己没有反垄断标记的牌 1 块"""
+        return len(self.market) - self.market_owned[player]
+
+    def legal(self) -> Legal:
+        """当前玩家的合法动作，状态变化后第一次调用时计算"""
+        legal = self._legal
+        if legal is None:
+            legal = self._legal = self._compute_legal()
+        return legal
+
+    def _compute_legal(self) -> Legal:
+        if self.status != "active":
+            return NO_MOVES
+        seat = self.current
+        owner = self.owner
+        hand = self.hands[seat]
+        companies = tuple(c for c in range(N_COMPANIES) if c in hand)
+        to_market = tuple(c for c in companies if owner[c] != seat)
+        if len(hand) == HAND_SIZE:
+            cost = self.draw_cost(seat)
+            return Legal(
+                seat,
+                bool(self.deck) and self.money[seat] >= cost,
+                cost,
+                tuple(i for i, c in enumerate(self.market) if owner[c] != seat),
+                companies,
+                to_market,
+            )
+        return Legal(seat, False, 0, (), companies, to_market)
+
+    # ---- 动作 ----
+    # 合法的动作只查一次 legal()；不合法时才逐条检查，给出具体的错误信息
+    def _check_turn(self, player: int):
+        if self.status != "active" or player != self.current:
+            raise RuleError("Not your turn")
+
+    def _draw_error(self, player: int):
+        self._check_turn(player)
+        if len(self.hands[player]) != HAND_SIZE:
+            raise RuleError("Hand must have 3 cards before drawing")
+        if not self.deck:
+            raise RuleError("Deck is empty")
+        raise RuleError(f"Need {self.draw_cost(player)} money")
+
+    def _take_error(self, player: int, index: int):
+        self._check_turn(player)
+        if len(self.hands[player]) != HAND_SIZE:
+            raise RuleError("Hand must have 3 cards before taking")
+        if index < 0 or index >= len(self.market):
+            raise RuleError("Invalid card index")
+        raise RuleError(f"You hold anti-monopoly token for {COMPANIES[self.market[index]]}")
+
+    def _play_error(self, player: int, company: int):
+        self._check_turn(player)
+        if company not in self.hands[player]:
+            raise RuleError("Card not in hand")
+        raise RuleError(f"Cannot put {COMPANIES[company]} on market")
+
+    def draw(self, player: int) -> Tuple[int, int]:
+        """从牌库抽牌，返回 (card, cost)"""
+        legal = self.legal()
+        if player != legal.seat or not legal.can_draw:
+            self._draw_error(player)
+
+        cost = legal.draw_cost
+        card = self.deck.pop()
+        self.money[player] -= cost
+        self.hands[player].append(card)
+        self.log += bytes((OP_DRAW, player, 0))
+        self._legal = None
+        return card, cost
+
+    def take(self, player: int, index: int) -> Tuple[int, int]:
+        """拿市场上第 index 张牌，返回 (company, coins)"""
+        legal = self.legal()
+        if player != legal.seat or index not in legal.take:
+            self._take_error(player, index)
+
+        company = self.market[index]
+        coins = self.market_coins[index]
+        self.hands[player].append(company)
+        self.money[player] += coins
+        del self.market[index]
+        del self.market_coins[index]
+        self.market_counts[company] -= 1
+        if self.owner[company] != NO_PLAYER:
+            self.market_owned[self.owner[company]] -= 1
+        self.log += bytes((OP_TAKE, player, index))
+        self._legal = None
+        return company, coins
+
+    def play(self, player: int, company: int, invest: bool) -> Tuple[int, bool]:
+        """打出一张手牌（投资或放到市场），返回 (手牌下标, 是否触发回合结算)"""
+        legal = self.legal()
+        if player != legal.seat or company not in (legal.invest if invest else legal.to_market):
+            self._play_error(player, company)
+
+        hand = self.hands[player]
+        hand_index = hand.index(company)
+        del hand[hand_index]
+        self.log += bytes((OP_INVEST if invest else OP_MARKET, player, company))
+        self._legal = None
+        if invest:
+            self._add_share(player, company)
+            self._set_owner(company, self.leader[company])
+        else:
+            self.market.append(company)
+            self.market_coins.append(0)
+            self.market_counts[company] += 1
+            if self.owner[company] != NO_PLAYER:
+                self.market_owned[self.owner[company]] += 1
+
+        round_ended = not self.deck
+        if round_ended:
+            self._end_round()
+        if self.status != "game_over":
+            self.current = (self.current + 1) % len(self.player_ids)
+        if self.check_index:
+            self.verify_index()
+        return hand_index, round_ended
+
+    # ---- 规则 ----
+    def _add_share(self, player: int, company: int):
+        """玩家在公司上加一股，同时更新最大股东索引"""
+        i = player * N_COMPANIES + company
+        holding = self.investments[i] + 1
+        self.investments[i] = holding
+        top = self.top[company]
+        if holding > top:
+            self.top[company] = holding
+            self.top_count[company] = 1
+            self.leader[company] = player
+        elif holding == top:
+            self.top_count[company] += 1
+            self.leader[company] = NO_PLAYER
+
+    def _set_owner(self, company: int, seat: int):
+        """反垄断标记换人，市场上这家公司的牌跟着换到新主人名下"""
+        old = self.owner[company]
+        if old == seat:
+            return
+        count = self.market_counts[company]
+        if count:
+            if old != NO_PLAYER:
+                self.market_owned[old] -= count
+            if seat != NO_PLAYER:
+                self.market_owned[seat] += count
+        self.owner[company] = seat
+
+    def _scan_index(self, company: int) -> Tuple[int, int, int]:
+        """全量扫描一家公司，返回 (top, top_count, leader)"""
+        inv = self.investments
+        column = [inv[i] for i in range(company, len(inv), N_COMPANIES)]
+        top = max(column)
+        count = column.count(top)
+        leader = column.index(top) if top and count == 1 else NO_PLAYER
+        return top, count, leader
+
+    def _scan_market(self) -> Tuple[bytearray, array]:
+        """全量扫描市场，返回 (market_counts, market_owned)"""
+        counts = bytearray(N_COMPANIES)
+        owned = array("i", [0] * len(self.player_ids))
+        for c in self.market:
+            counts[c] += 1
+            if self.owner[c] != NO_PLAYER:
+                owned[self.owner[c]] += 1
+        return counts, owned
+
+    def _rebuild_index(self):
+        self.market_counts, self.market_owned = self._scan_market()
+        n = len(self.player_ids)
+        self.top = bytearray(N_COMPANIES)
+        self.top_count = bytearray([n] * N_COMPANIES)
+        self.leader = array("b", [NO_PLAYER] * N_COMPANIES)
+        for company in range(N_COMPANIES):
+            top, count, leader = self._scan_index(company)
+            self.top[company] = top
+            self.top_count[company] = count
+            self.leader[company] = leader
+
+    def verify_index(self):
+        """全量重算最大股东索引和市场计数并与增量结果比对"""
+        counts, owned = self._scan_market()
+        if counts != self.market_counts or owned != self.market_owned:
+            raise AssertionError(
+                f"market counts out of sync: {list(self.market_counts)}/{list(counts)} "
+                f"{self.market_owned.tolist()}/{owned.tolist()}"
+            )
+        for company in range(N_COMPANIES):
+            top, count, leader = self._scan_index(company)
+            if (
+                self.top[company] != top
+                or self.top_count[company] != count
+                or self.leader[company] != leader
+            ):
+                raise AssertionError(
+                    f"leader index out of sync for {COMPANIES[company]}: "
+                    f"top={self.top[company]}/{top} "
+                    f"count={self.top_count[company]}/{count} "
+                    f"leader={self.leader[company]}/{leader}"
+                )
+
+    def _end_round(self):
+        for p, hand in enumerate(self.hands):
+            for c in hand:
+                self._add_share(p, c)
+            hand.clear()
+        SETTLEMENT.settle(self.investments, self.money, self.score, self.leader)
+
+        if self.round_number >= LAST_ROUND:
+            self.status = "game_over"
+            return
+        self.round_number += 1
+        deck = SETTLEMENT.deck(self.removed)
+        round_rng(self.seed, self.round_number).shuffle(deck)
+        self.deck = deck
+        self.market = bytearray()
+        self.market_coins = array("i")
+        self.market_counts = bytearray(N_COMPANIES)
+        self.market_owned = array("i", [0] * len(self.player_ids))
+        for hand in self.hands:
+            hand.extend(deck.pop() for _ in range(HAND_SIZE))
+        self.current = 0
+        self.owner = array("b", self.leader)
+
+    # ---- 快照 ----
+    def dump(self) -> dict:
+        """紧凑快照（字节数组存成 hex），可以 json 序列化；派生的索引不保存"""
+        return {
+            "game_id": self.game_id,
+            "player_ids": self.player_ids,
+            "hands": [hand.hex() for hand in self.hands],
+            "investments": self.investments.hex(),
+            "money": self.money.tolist(),
+            "score": self.score.tolist(),
+            "deck": self.deck.hex(),
+            "removed": self.removed.hex(),
+            "market": self.market.hex(),
+            "market_coins": self.market_coins.tolist(),
+            "owner": self.owner.tolist(),
+            "current": self.current,
+            "round_number": self.round_number,
+            "status": self.status,
+            "seed": self.seed,
+            "log": self.log.hex(),
+        }
+
+    @classmethod
+    def load(cls, data: dict) -> "Game":
+        """从 dump() 的结果恢复"""
+        game = cls.__new__(cls)
+        game.game_id = data["game_id"]
+        game.player_ids = list(data["player_ids"])
+        game.seats = {pid: i for i, pid in enumerate(game.player_ids)}
+        game.seed = data["seed"]
+        game.log = bytearray.fromhex(data["log"])
+        game.hands = [bytearray.fromhex(h) for h in data["hands"]]
+        game.investments = bytearray.fromhex(data["investments"])
+        game.money = array("i", data["money"])
+        game.score = array("i", data["score"])
+        game.deck = bytearray.fromhex(data["deck"])
+        game.removed = bytes.fromhex(data["removed"])
+        game.market = bytearray.fromhex(data["market"])
+        game.market_coins = array("i", data["market_coins"])
+        game.owner = array("b", data["owner"])
+        game.current = data["current"]
+        game.round_number = data["round_number"]
+        game.status = data["status"]
+        game._legal = None
+        game._rebuild_index()
+        return game
+
+    # ---- 对外视图 ----
+    def winner(self) -> str:
+        return self.player_ids[max(range(len(self.score)), key=self.score.__getitem__)]
+
+    def final_scores(self) -> Dict[str, int]:
+        return dict(zip(self.player_ids, self.score))
+
+    def owner_id(self, company: int) -> Optional[str]:
+        owner = self.owner[company]
+        return None if owner == NO_PLAYER else self.player_ids[owner]
+
+    def player_dict(self, player: int) -> dict:
+        base = player * N_COMPANIES
+        owner = self.owner
+        return {
+            "player_id": self.player_ids[player],
+            "hand": [COMPANIES[c] for c in self.hands[player]],
+            "investments": {
+                name: self.investments[base + c] for c, name in enumerate(COMPANIES)
+            },
+            "money": self.money[player],
+            "score": self.score[player],
+            "has_antimonopoly": {
+                name: owner[c] == player for c, name in enumerate(COMPANIES)
+            },
+        }
+
+    def hand(self, player: int) -> List[str]:
+        return [COMPANIES[c] for c in self.hands[player]]
+
+    def public_player_dict(self, player: int) -> dict:
+        """其他人能看到的部分：手牌只有张数"""
+        data = self.player_dict(player)
+        data["hand_size"] = len(data.pop("hand"))
+        return data
+
+    def legal_dict(self, player: int) -> dict:
+        """player 现在能做的动作；phase 为 take（手里 3 张，可以抽牌、拿牌，也可以直接打牌）、
+        play（只能打牌）、wait 或 over"""
+        legal = self.legal()
+        if self.status != "active":
+            phase = "over"
+        elif player != legal.seat:
+            phase = "wait"
+        else:
+            phase = "take" if len(self.hands[player]) == HAND_SIZE else "play"
+        mine = phase in ("take", "play")
+        return {
+            "player_id": self.player_ids[player],
+            "phase": phase,
+            "can_draw": mine and legal.can_draw,
+            "draw_cost": legal.draw_cost if mine else 0,
+            "take": list(legal.take) if mine else [],
+            "invest": [COMPANIES[c] for c in legal.invest] if mine else [],
+            "to_market": [COMPANIES[c] for c in legal.to_market] if mine else [],
+        }
+
+    def view(self) -> dict:
+        """公开视图：手牌、牌库和移除的牌只给数量"""
+        return {
+            "game_id": self.game_id,
+            "players": {
+                pid: self.public_player_dict(p) for p, pid in enumerate(self.player_ids)
+            },
+            "market_deck_size": len(self.deck),
+            "market_display": [
+                {"company": COMPANIES[c], "coins_on_top": coins}
+                for c, coins in zip(self.market, self.market_coins)
+            ],
+            "removed_count": len(self.removed),
+            "current_player_id": self.player_ids[self.current],
+            "round_number": self.round_number,
+            "status": self.status,
+            "antimonopoly_owner": {
+                name: self.owner_id(c) for c, name in enumerate(COMPANIES)
+            },
+        }
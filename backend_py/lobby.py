@@ -0,0 +1,62 @@
+import asyncio
+import heapq
+from typing import Callable, Dict, List, Optional
+
+from registry import LISTED_STATUSES
+
+# ====== 大厅推送 ======
+# RoomRegistry 的条目变化先攒在 pending 里，每 interval 秒合并成一条 lobby_update 发出：
+# 一阵密集的加入/离开只推一次，同一房间只推最后的状态。
+# 大厅连接订阅总线上的 LOBBY_CHANNEL（房间号不会与它重名），多 worker 时各自发布本分片的变化。
+
+LOBBY_CHANNEL = "lobby"
+
+
+class LobbyFeed:
+    """registry 的监听器，合并变化后调用 publish(message)
+
+    消息格式：{"type": "lobby_update", "rooms": [新增或变化的条目], "removed": [房间号]}，
+    开始游戏后条目的 status 变为 active，结束或删除的房间出现在 removed 里。
+    """
+
+    def __init__(self, publish: Callable[[dict], None], interval: float = 0.1):
+        self.publish = publish
+        self.interval = interval
+        self.pending: Dict[str, Optional[dict]] = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def on_change(self, room_id: str, entry: Optional[dict]):
+        if entry is not None and entry["status"] not in LISTED_STATUSES:
+            entry = None
+        self.pending[room_id] = entry
+        if self._handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 事件循环之外（离线工具等）没有人订阅，攒着等下一次即可
+                return
+            self._handle = loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        self._handle = None
+        if not self.pending:
+            return
+        changes, self.pending = self.pending, {}
+        self.publish(
+            {
+                "type": "lobby_update",
+                "rooms": [entry for entry in changes.values() if entry is not None],
+                "removed": [room_id for room_id, entry in changes.items() if entry is None],
+            }
+        )
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+def lobby_state(pages: List[List[dict]], limit: int) -> dict:
+    """新连接的大厅快照：各分片的列表按 cursor 归并"""
+    merged = heapq.merge(*pages, key=lambda entry: entry["cursor"])
+    return {"type": "lobby_state", "rooms": list(merged)[:limit]}
@@ -1,15 +1,75 @@
 import asyncio
+import functools
 import json
-import random
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
 from enum import Enum
-from typing import Dict, List, Optional, Literal, Set, Any
+from typing import TYPE_CHECKING, Collection, Dict, List, Optional, Literal, Any, Set, Tuple
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
-from pydantic.v1 import Field
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 from starlette.middleware.cors import CORSMiddleware
-
-app = FastAPI(title="Startups")
+from starlette.responses import PlainTextResponse
+
+from actor import ActorRegistry, RoomBusy
+from broadcast import Broadcaster, ConnectionLimiter, player_channel
+from cluster import ClusterConfig, ShardRouter, fetch_all, fetch_json, forward_http, is_internal
+from codec import FastJSONResponse, dumps_text
+from engine import COMPANIES, COMPANY_INDEX, NO_PLAYER, Game, RuleError
+from lobby import LOBBY_CHANNEL, LobbyFeed, lobby_state
+from metrics import REGISTRY, SAMPLER, SIZE_BUCKETS, counter, gauge, histogram
+from registry import RoomRegistry
+from replay import game_record, replay, steps
+from sessions import RoomIds, SessionTable
+from spectate import SpectatorHub, spectator_channel
+from state_stream import StateStream
+
+if TYPE_CHECKING:
+    from storage import RoomStore
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global store
+    # STARTUPS_DB 设为空字符串时不持久化
+    path = cluster.db_path(os.environ.get("STARTUPS_DB", "startups.db"))
+    if path:
+        # 持久化是可选的，关闭时不导入 sqlite3
+        from storage import RoomStore
+
+        store = RoomStore(path, int(os.environ.get("STARTUPS_SNAPSHOT_EVERY", "50")))
+        _recover()
+    await bus.start()
+    bus.subscribe(CONTROL_CHANNEL)
+    # 恢复出来的房间不推送，总线就绪后才开始监听
+    rooms.listeners.append(lobby.on_change)
+    # STARTUPS_PROFILE=1 时启动采样分析器，结果见 GET /metrics/profile
+    if os.environ.get("STARTUPS_PROFILE") == "1":
+        SAMPLER.start()
+    reaper = asyncio.create_task(_reaper()) if REAP_INTERVAL > 0 else None
+    heartbeat = asyncio.create_task(_heartbeat()) if HEARTBEAT_INTERVAL > 0 else None
+    yield
+    if reaper is not None:
+        reaper.cancel()
+    if heartbeat is not None:
+        heartbeat.cancel()
+    rooms.listeners.remove(lobby.on_change)
+    lobby.close()
+    spectators.close_all()
+    SAMPLER.stop()
+    await actors.close()
+    await bus.close()
+    if store is not None:
+        store.close()
+        store = None
+
+
+app = FastAPI(
+    title="Startups", default_response_class=FastJSONResponse, lifespan=lifespan
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,16 +77,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# ====== 常量 ======
-COMPANIES = ["card5", "card6", "card7", "card8", "card9", "card10"]
-COMPANY_CARD_COUNTS = {
-    "card5": 5,
-    "card6": 6,
-    "card7": 7,
-    "card8": 8,
-    "card9": 9,
-    "card10": 10,
-}
+
+# 多 worker 部署时按 room_id 分片，见 cluster.py
+cluster = ClusterConfig.from_env()
+if cluster.enabled:
+    app.add_middleware(ShardRouter, cluster=cluster)
 
 
 class Response(BaseModel):
@@ -35,33 +90,12 @@ class Response(BaseModel):
     data: Any = Field(default_factory=dict)
 
 
-# ====== 数据模型（同前）======
-class PlayerState(BaseModel):
-    player_id: str
-    hand: List[str]
-    investments: Dict[str, int]
-    money: int
-    score: int
-    has_antimonopoly: Dict[str, bool]
-
-
-class MarketCard(BaseModel):
-    company: str
-    coins_on_top: int = 0
-
-
-class GameState(BaseModel):
-    game_id: str
-    players: Dict[str, PlayerState]
-    market_deck: List[str]
-    market_display: List[MarketCard]
-    removed_cards: List[str]
-    current_player_id: str
-    round_number: int
-    status: Literal["active", "round_end", "game_over"]
-    antimonopoly_owner: Dict[str, Optional[str]]
+def ok(data: Any = None) -> FastJSONResponse:
+    """成功响应：直接编码 Response，不经过 jsonable_encoder 二次处理"""
+    return FastJSONResponse(Response() if data is None else Response(data=data))
 
 
+# ====== 数据模型 ======
 class RoomStatus(str, Enum):
     waiting = "waiting"
     active = "active"
@@ -74,140 +108,509 @@ class Room(BaseModel):
     max_players: int = 7
     players: List[str]
     status: RoomStatus
-    game_state: Optional[GameState] = None
+    # 引擎对象只在服务端使用，对外通过 game_state 视图输出
+    game: Optional[Game] = Field(default=None, exclude=True)
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @computed_field
+    @property
+    def game_state(self) -> Optional[Dict[str, Any]]:
+        """公开视图，不含任何人的手牌；玩家自己的视图见 _room_view"""
+        return _game_view(self)
 
 
 # ====== 全局状态 ======
-rooms: Dict[str, Room] = {}
+rooms = RoomRegistry()
+
+# WebSocket 连接管理：每个连接独立的发送队列
+broadcaster = Broadcaster()
 
-# WebSocket 连接管理：room_id -> set of WebSocket
-websocket_connections: Dict[str, Set[WebSocket]] = {}
+# 观战：公开广播延迟 STARTUPS_SPECTATOR_DELAY 秒后，每 STARTUPS_SPECTATOR_WINDOW 秒合并成一帧
+spectators = SpectatorHub(
+    broadcaster,
+    delay=float(os.environ.get("STARTUPS_SPECTATOR_DELAY", "0")),
+    window=float(os.environ.get("STARTUPS_SPECTATOR_WINDOW", "0.1")),
+)
 
 
-# ====== 广播工具函数 ======
-async def broadcast_to_room(room_id: str, message: dict):
-    """向指定房间的所有 WebSocket 客户端广播消息"""
-    print(websocket_connections)
-    if room_id not in websocket_connections:
+# 控制频道：每个 worker 都订阅，用来让其他 worker 上的旧连接让位
+CONTROL_CHANNEL = "control"
+
+
+def _deliver(channel: str, text: str):
+    if channel == CONTROL_CHANNEL:
+        _on_control(json.loads(text))
         return
-    dead_connections = set()
-    for ws in websocket_connections[room_id]:
-        try:
-            await ws.send_json(message)
-        except Exception:
-            dead_connections.add(ws)
-    # 清理断开的连接
-    for ws in dead_connections:
-        websocket_connections[room_id].discard(ws)
-
-
-# ====== 游戏逻辑辅助函数（同前）======
-def _create_game_state(player_ids: List[str]) -> GameState:
-    full_deck = []
-    for comp, count in COMPANY_CARD_COUNTS.items():
-        full_deck.extend([comp] * count)
-    random.shuffle(full_deck)
-    removed = [full_deck.pop() for _ in range(5)]
-    market_deck = full_deck.copy()
-
-    players = {}
-    for pid in player_ids:
-        hand = [market_deck.pop() for _ in range(3)]
-        players[pid] = PlayerState(
-            player_id=pid,
-            hand=hand,
-            investments={c: 0 for c in COMPANIES},
-            money=10,
-            score=0,
-            has_antimonopoly={c: False for c in COMPANIES},
-        )
+    broadcaster.publish_text(channel, text)
+    spectators.offer(channel, text)
 
-    antimonopoly_owner = {c: None for c in COMPANIES}
-
-    return GameState(
-        game_id=f"game_{player_ids[0]}",
-        players=players,
-        market_deck=market_deck,
-        market_display=[],
-        removed_cards=removed,
-        current_player_id=player_ids[0],
-        round_number=1,
-        status="active",
-        antimonopoly_owner=antimonopoly_owner,
+
+# 房间广播总线：单进程时直接回调，多 worker 时经总线进程转发给持有连接的 worker
+bus = cluster.make_bus(_deliver)
+
+# 大厅推送：房间条目的变化合并后发到总线的大厅频道
+def _publish_lobby(message: dict):
+    bus.publish(LOBBY_CHANNEL, dumps_text(message))
+
+
+lobby = LobbyFeed(_publish_lobby)
+# 新大厅连接的快照最多带多少个房间，更多的用 /room/list 翻页
+LOBBY_SNAPSHOT_LIMIT = 200
+
+# 房间号分配；多 worker 时只分配归本分片所有的号码
+room_ids = RoomIds(cluster.owns if cluster.enabled else None)
+
+# 会话令牌：token -> (room_id, 座位号)
+sessions = SessionTable()
+
+# 状态流：room_id -> StateStream
+room_streams: Dict[str, StateStream] = {}
+
+# 动作日志和快照，未启用持久化时为 None
+store: Optional["RoomStore"] = None
+
+# 每个房间一个 actor，所有修改房间的命令都在 actor 里串行执行
+actors = ActorRegistry()
+
+# 各状态的房间闲置多久（秒）后回收；进行中和等待中的房间只要还有连接就不回收
+ROOM_TTL = {
+    RoomStatus.waiting.value: float(os.environ.get("STARTUPS_TTL_WAITING", "3600")),
+    RoomStatus.active.value: float(os.environ.get("STARTUPS_TTL_ACTIVE", "1800")),
+    RoomStatus.finished.value: float(os.environ.get("STARTUPS_TTL_FINISHED", "600")),
+}
+# 每个房间保留最近多少条带序号的广播，供断线重连的客户端补发
+REPLAY_EVENTS = int(os.environ.get("STARTUPS_REPLAY_EVENTS", "64"))
+
+# 回收检查的间隔，0 表示不回收
+REAP_INTERVAL = float(os.environ.get("STARTUPS_REAP_INTERVAL", "30"))
+
+# 心跳：每隔 HEARTBEAT_INTERVAL 秒给所有连接发 ping，客户端回 pong（任何消息都算）；
+# 超过 HEARTBEAT_TIMEOUT 秒没有收到任何消息的连接断开。间隔为 0 时关闭心跳
+HEARTBEAT_INTERVAL = float(os.environ.get("STARTUPS_HEARTBEAT_INTERVAL", "20"))
+HEARTBEAT_TIMEOUT = (
+    float(os.environ.get("STARTUPS_HEARTBEAT_TIMEOUT", "60")) if HEARTBEAT_INTERVAL > 0 else None
+)
+PING = dumps_text({"type": "ping"})
+
+# 管理接口（POST /metrics/profile）的令牌，放在 x-startups-admin 头里；不设时只有其他 worker 能调用
+ADMIN_TOKEN = os.environ.get("STARTUPS_ADMIN_TOKEN", "")
+ADMIN_HEADER = "x-startups-admin"
+
+# 本 worker 的 WebSocket 连接总数和每个 IP 的连接数上限，0 表示不限
+limiter = ConnectionLimiter(
+    int(os.environ.get("STARTUPS_MAX_CONNECTIONS", "10000")),
+    int(os.environ.get("STARTUPS_MAX_CONNECTIONS_PER_IP", "100")),
+)
+
+# ====== 指标 ======
+if cluster.enabled:
+    REGISTRY.const_labels["shard"] = str(cluster.shard)
+COMMAND_SECONDS = histogram(
+    "startups_command_seconds", "房间命令在 actor 里的执行耗时", ("command",)
+)
+COMMANDS = counter("startups_commands_total", "房间命令数，按结果状态码", ("command", "status"))
+BROADCAST_SECONDS = histogram("startups_broadcast_seconds", "broadcast_to_room 耗时（含编码）")
+QUEUE_DEPTH = histogram(
+    "startups_room_queue_depth", "命令入队时房间 actor 队列里已有的命令数", buckets=SIZE_BUCKETS
+)
+BUSY = counter("startups_room_busy_total", "因房间队列已满被拒绝的命令")
+EVICTED = counter("startups_rooms_evicted_total", "闲置超时被回收的房间，按回收时的状态", ("status",))
+RESUMES = counter(
+    "startups_ws_resumes_total", "带 since 重连的 WebSocket，按补发方式", ("result",)
+)
+IGNORED = counter("startups_ws_ignored_messages_total", "无法识别的 WebSocket 消息")
+WS_CLOSED = counter("startups_ws_closed_total", "服务端主动断开的连接，按原因", ("reason",))
+WS_REJECTED = counter("startups_ws_rejected_total", "超过连接数上限被拒绝的连接", ("limit",))
+gauge("startups_rooms", "本 worker 上的房间数", lambda: len(rooms))
+gauge("startups_actors", "本 worker 上的房间 actor 数", lambda: len(actors.actors))
+gauge("startups_sessions", "本 worker 上有效的会话令牌数", lambda: len(sessions))
+gauge("startups_connections", "本 worker 上的 WebSocket 连接数", broadcaster.count)
+gauge("startups_spectators", "本 worker 上的观战连接数", spectators.count)
+
+
+def _instrumented(name: str):
+    """房间命令：记录耗时和结果，并告诉采样分析器当前在处理哪个房间"""
+
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(room_id: str, *args):
+            SAMPLER.room = room_id
+            status = 200
+            start = time.perf_counter()
+            try:
+                return fn(room_id, *args)
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except Exception:
+                status = 500
+                raise
+            finally:
+                COMMAND_SECONDS.observe(time.perf_counter() - start, command=name)
+                COMMANDS.inc(command=name, status=status)
+                SAMPLER.room = None
+
+        return run
+
+    return wrap
+
+
+# ====== 广播工具函数 ======
+def broadcast_to_room(room_id: str, message: dict, seq: Optional[int] = None):
+    """向指定房间的所有 WebSocket 客户端广播消息，只入队不等待发送
+
+    连接可能在其他 worker 上，所以消息编码一次后发到总线。
+    给定 seq 的消息同时记入状态流的重放缓冲，断线重连时补发。
+    """
+    start = time.perf_counter()
+    if seq is not None:
+        stream = _get_stream(room_id)
+        message["epoch"] = stream.epoch
+        text = dumps_text(message)
+        stream.record(seq, text)
+    else:
+        text = dumps_text(message)
+    bus.publish(room_id, text)
+    BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+
+def broadcast_to_player(room_id: str, player: str, message: dict, seq: Optional[int] = None):
+    """只发给房间里的某个玩家，走该玩家的私有频道"""
+    if seq is not None:
+        stream = _get_stream(room_id)
+        message["epoch"] = stream.epoch
+        text = dumps_text(message)
+        stream.record(seq, text, to=player)
+    else:
+        text = dumps_text(message)
+    bus.publish(player_channel(room_id, player), text)
+
+
+def _send_private(room_id: str, patch: dict, data: Optional[Dict[str, dict]] = None):
+    """把补丁里只属于个别玩家的操作（以及 data 里给他的附加信息）单独发给他
+
+    消息为 {"type": "private", "seq", "ops"[, "data"][, "legal"]}，序号与同一次提交的公开消息相同。
+    轮到谁，谁的消息里就带上他现在的合法动作（见 Game.legal_dict），没有私有操作时 ops 为空。
+    """
+    seq = patch["seq"]
+    private = patch.get("private", {})
+    game = rooms[room_id].game
+    mover = None
+    if game is not None and game.status == "active":
+        mover = game.player_ids[game.current]
+    players = list(private)
+    if mover is not None and mover not in private:
+        players.append(mover)
+    for player in players:
+        message = {"type": "private", "seq": seq, "ops": private.get(player, [])}
+        if data is not None and player in data:
+            message["data"] = data[player]
+        if player == mover:
+            message["legal"] = game.legal_dict(game.current)
+        broadcast_to_player(room_id, player, message, seq)
+
+
+def _get_stream(room_id: str) -> StateStream:
+    if room_id not in room_streams:
+        room_streams[room_id] = StateStream(REPLAY_EVENTS)
+    return room_streams[room_id]
+
+
+# ====== 玩家视图 ======
+# 每个人只能看到自己的手牌；牌库和移除的牌只有数量。
+# 视图按状态版本缓存在状态流的 cache 里：同一版本下 N 个人要快照只生成一次公开视图，
+# 每个玩家的视图在公开视图上换掉自己那一项，提交新补丁时整体作废。
+# 缓存记着生成时的 (牌局, 序号)，版本对不上就整体重建；读视图的接口都是 async 的，与动作在同一个线程里。
+_CACHED_VERSION = object()
+
+
+def _game_view(room: Room, viewer: Optional[str] = None) -> Optional[dict]:
+    """viewer 看到的 game_state；viewer 为 None 或不在牌局里时返回公开视图"""
+    game = room.game
+    if game is None:
+        return None
+    stream = _get_stream(room.room_id)
+    cache = stream.cache
+    version = cache.get(_CACHED_VERSION)
+    if version is None or version[0] is not game or version[1] != stream.seq:
+        # 状态前进了，或者同一个房间号换了一局，旧缓存作废
+        cache.clear()
+        cache[_CACHED_VERSION] = (game, stream.seq)
+    public = cache.get(None)
+    if public is None:
+        public = cache[None] = game.view()
+    seat = NO_PLAYER if viewer is None else game.seat(viewer)
+    if seat == NO_PLAYER:
+        return public
+    view = cache.get(viewer)
+    if view is None:
+        players = dict(public["players"])
+        players[viewer] = {**players[viewer], "hand": game.hand(seat)}
+        view = cache[viewer] = {**public, "players": players}
+    return view
+
+
+def _room_view(room: Room, viewer: Optional[str] = None):
+    """viewer 看到的房间；公开视图直接用 Room 本身"""
+    if viewer is None or room.game is None:
+        return room
+    return {
+        "room_id": room.room_id,
+        "host_player_name": room.host_player_name,
+        "max_players": room.max_players,
+        "players": room.players,
+        "status": room.status.value,
+        "game_state": _game_view(room, viewer),
+    }
+
+
+def _patch_for(patch: dict, viewer: Optional[str]) -> dict:
+    """viewer 能看到的补丁：公开操作加上只属于他的操作"""
+    private = patch.get("private", {}).get(viewer)
+    return {"seq": patch["seq"], "ops": patch["ops"] + private if private else patch["ops"]}
+
+
+def _snapshot(room: Room, viewer: Optional[str] = None) -> dict:
+    """完整快照，新连接和落后的客户端用它重新对齐；轮到 viewer 时附带他的合法动作"""
+    stream = _get_stream(room.room_id)
+    snapshot = {
+        "type": "room_state",
+        "seq": stream.seq,
+        "epoch": stream.epoch,
+        "data": _room_view(room, viewer),
+    }
+    game = room.game
+    if viewer is not None and game is not None and game.status == "active":
+        seat = game.seat(viewer)
+        if seat == game.current:
+            snapshot["legal"] = game.legal_dict(seat)
+    return snapshot
+
+
+async def _load_snapshot(room_id: str, viewer: Optional[str] = None) -> Optional[dict]:
+    """本 worker 的房间直接生成快照，其他分片的房间向所在的 worker 要"""
+    if cluster.owns(room_id):
+        room = rooms.get(room_id)
+        return None if room is None else _snapshot(room, viewer)
+    query = "" if viewer is None else "?" + urlencode({"player": viewer})
+    return await fetch_json(cluster, room_id, f"/room/{room_id}/snapshot{query}")
+
+
+def _snapshot_players(snapshot: dict) -> List[str]:
+    data = snapshot["data"]
+    return data["players"] if isinstance(data, dict) else data.players
+
+
+def _snapshot_status(snapshot: dict) -> str:
+    data = snapshot["data"]
+    return data["status"] if isinstance(data, dict) else data.status.value
+
+
+def _action_result(
+    room: Room, patch: Optional[dict], delta: bool, viewer: Optional[str]
+) -> FastJSONResponse:
+    """delta=True 时只返回本次变更的补丁，否则返回完整房间；都是 viewer 自己的视图，viewer 为 None 时是公开视图"""
+    if delta:
+        stream = _get_stream(room.room_id)
+        if patch is None:
+            return ok({"seq": stream.seq, "epoch": stream.epoch, "ops": []})
+        return ok({**_patch_for(patch, viewer), "epoch": stream.epoch})
+    return ok(_room_view(room, viewer))
+
+
+def _respond(
+    delta: bool, viewer: Optional[str], fn, room_id: str, player_id: str, *args
+) -> FastJSONResponse:
+    """在 actor 里执行动作并立即生成响应，响应体就是这次动作之后 viewer 看到的状态
+
+    只有凭会话令牌识别的玩家才拿到自己的视图（手牌、私有操作），只给玩家名时 viewer 为 None。
+    """
+    room, patch = fn(room_id, player_id, *args)
+    return _action_result(room, patch, delta, viewer)
+
+
+# ====== 游戏逻辑辅助函数 ======
+def _set_hand_size(stream: StateStream, game: Game, seat: int):
+    stream.set(
+        ["game_state", "players", game.player_ids[seat], "hand_size"], len(game.hands[seat])
     )
 
 
-def _update_antimonopoly_token(game: GameState, company: str):
-    holdings = [(pid, p.investments[company]) for pid, p in game.players.items()]
-    max_holding = max(holdings, key=lambda x: x[1])[1]
-    if max_holding == 0:
-        game.antimonopoly_owner[company] = None
+def _set_game_state(stream: StateStream, game: Game):
+    """整个 game_state 换成公开视图，每个玩家的手牌作为私有操作单独下发"""
+    stream.set(["game_state"], game.view())
+    for seat, player in enumerate(game.player_ids):
+        stream.set(["game_state", "players", player, "hand"], game.hand(seat), to=player)
+
+
+def _record_antimonopoly(
+    stream: StateStream, game: Game, company: int, old_owner: Optional[str]
+):
+    name = COMPANIES[company]
+    new_owner = game.owner_id(company)
+    if new_owner == old_owner:
         return
-    leaders = [pid for pid, h in holdings if h == max_holding]
-    if len(leaders) == 1:
-        new_owner = leaders[0]
-        old_owner = game.antimonopoly_owner[company]
-        if old_owner != new_owner:
-            if old_owner:
-                game.players[old_owner].has_antimonopoly[company] = False
-            game.antimonopoly_owner[company] = new_owner
-            game.players[new_owner].has_antimonopoly[company] = True
-    else:
-        old_owner = game.antimonopoly_owner[company]
-        if old_owner:
-            game.players[old_owner].has_antimonopoly[company] = False
-        game.antimonopoly_owner[company] = None
-
-
-def _end_round(game: GameState):
-    for player in game.players.values():
-        for card in player.hand:
-            player.investments[card] += 1
-        player.hand.clear()
-
-    for company in COMPANIES:
-        holdings = [(pid, p.investments[company]) for pid, p in game.players.items()]
-        max_holding = max(holdings, key=lambda x: x[1])[1]
-        if max_holding == 0:
-            continue
-        leaders = [pid for pid, h in holdings if h == max_holding]
-        if len(leaders) != 1:
-            continue
-        major = leaders[0]
-        for pid, shares in holdings:
-            if pid == major:
-                continue
-            owed = shares * 3
-            payer = game.players[pid]
-            receiver = game.players[major]
-            receiver.money += min(payer.money, owed)
-            payer.money -= owed
-
-    sorted_players = sorted(game.players.values(), key=lambda p: p.money, reverse=True)
-    n = len(sorted_players)
-    if n >= 2:
-        sorted_players[0].score += 2
-        sorted_players[1].score += 1
-        sorted_players[-1].score -= 1
-
-    if game.round_number >= 2:
-        game.status = "game_over"
+    stream.set(["game_state", "antimonopoly_owner", name], new_owner)
+    if old_owner:
+        stream.set(["game_state", "players", old_owner, "has_antimonopoly", name], False)
+    if new_owner:
+        stream.set(["game_state", "players", new_owner, "has_antimonopoly", name], True)
+
+
+def _remove_player(room: Room, player_name: str):
+    seat = room.players.index(player_name)
+    del room.players[seat]
+    sessions.remove_seat(room.room_id, seat)
+    if player_name == room.host_player_name and room.players:
+        room.host_player_name = room.players[0]
+    rooms.touch(room)
+
+
+def _finish_if_over(room: Room):
+    if room.game.status == "game_over":
+        room.status = RoomStatus.finished
+        rooms.touch(room)
+
+
+# ====== 持久化 ======
+def _room_snapshot(room: Room) -> dict:
+    return {
+        "room_id": room.room_id,
+        "host_player_name": room.host_player_name,
+        "max_players": room.max_players,
+        "players": room.players,
+        "status": room.status.value,
+        "game": None if room.game is None else room.game.dump(),
+        "tokens": sessions.by_room.get(room.room_id, []),
+    }
+
+
+def _room_from_snapshot(data: dict) -> Room:
+    game = data.pop("game")
+    tokens = data.pop("tokens")
+    room = Room(**data)
+    room.game = None if game is None else Game.load(game)
+    sessions.drop_room(room.room_id)
+    for token in tokens:
+        sessions.issue(room.room_id, token)
+    return room
+
+
+def _log(room: Room, kind: str, payload: Optional[dict] = None):
+    """动作写入日志，积累够数量后写快照"""
+    if store is None:
+        return
+    if store.append(room.room_id, kind, payload):
+        store.snapshot(room.room_id, _room_snapshot(room))
+
+
+def _replay(room: Optional[Room], kind: str, payload: dict) -> Optional[Room]:
+    """把一条日志动作重新作用到房间上，日志里的动作都已经校验过"""
+    if kind == "create":
+        sessions.drop_room(payload["room_id"])
+        sessions.issue(payload["room_id"], payload["token"])
+        return Room(
+            room_id=payload["room_id"],
+            host_player_name=payload["host"],
+            players=[payload["host"]],
+            status=RoomStatus.waiting,
+        )
+    if room is None or kind == "delete":
+        return None
+    if kind == "join":
+        room.players.append(payload["player"])
+        sessions.issue(room.room_id, payload["token"])
+    elif kind == "leave":
+        _remove_player(room, payload["player"])
+        if not room.players:
+            return None
+    elif kind == "start":
+        # 种子记在日志里，重放出的牌局与当时相同
+        room.game = Game(room.players, seed=payload["seed"])
+        room.status = RoomStatus.active
     else:
-        game.round_number += 1
-        full_deck = []
-        for comp, count in COMPANY_CARD_COUNTS.items():
-            full_deck.extend([comp] * count)
-        for r in game.removed_cards:
-            full_deck.remove(r)
-        random.shuffle(full_deck)
-        game.market_deck = full_deck
-        game.market_display = []
-        for p in game.players.values():
-            p.hand = [game.market_deck.pop() for _ in range(3)]
-        game.current_player_id = list(game.players.keys())[0]
-
-        for comp in COMPANIES:
-            _update_antimonopoly_token(game, comp)
+        game = room.game
+        seat = game.seat(payload["player"])
+        if kind == "draw":
+            game.draw(seat)
+        elif kind == "take":
+            game.take(seat, payload["index"])
+        elif kind == "play":
+            game.play(seat, COMPANY_INDEX[payload["company"]], payload["invest"])
+            _finish_if_over(room)
+    return room
+
+
+def _recover():
+    """从快照和动作日志重建所有房间"""
+    start = time.perf_counter()
+    for room_id, snapshot, actions in store.load():
+        room = None if snapshot is None else _room_from_snapshot(snapshot)
+        for kind, payload in actions:
+            room = _replay(room, kind, payload)
+        if room is None:
+            sessions.drop_room(room_id)
+            store.delete(room_id)
+        else:
+            rooms[room_id] = room
+    store.recovery_seconds = round(time.perf_counter() - start, 4)
+    print(f"recovered {len(rooms)} rooms in {store.recovery_seconds}s")
+
+
+async def _in_room(room_id: str, fn, *args, touch: bool = True):
+    """在房间的 actor 里执行命令，返回它的结果；房间已不存在时回收 actor
+
+    touch=False 的命令（回收检查）不算房间有活动，不会重置闲置时间。
+    """
+    try:
+        actor = actors.get(room_id)
+        QUEUE_DEPTH.observe(actor.queue.qsize())
+        return await actor.submit(fn, *args)
+    except RoomBusy:
+        BUSY.inc()
+        raise HTTPException(503, "Room busy, try again later")
+    finally:
+        if room_id not in rooms:
+            actors.stop(room_id)
+        elif touch:
+            rooms.mark_active(room_id)
+
+
+def _player_of(room_id: str, player_id: Optional[str], token: Optional[str]) -> str:
+    """按会话令牌或玩家名识别玩家，令牌优先；令牌直接给出座位号，不用查找玩家列表"""
+    if token is None:
+        if player_id is None:
+            raise HTTPException(422, "player_id or token required")
+        return player_id
+    player = _session_player(room_id, token)
+    if player is None:
+        raise HTTPException(401, "Invalid session token")
+    return player
+
+
+def _session_player(room_id: str, token: str) -> Optional[str]:
+    """令牌对应的玩家名；令牌无效或不属于这个房间时返回 None"""
+    session = sessions.get(token)
+    room = rooms.get(room_id)
+    if session is None or session.room_id != room_id or room is None:
+        return None
+    return room.players[session.seat]
+
+
+def _internal(request: Request):
+    """只给其他 worker 调用的接口：客户端的请求（包括代客户端转发的）一律拒绝，免得绕过令牌拿到别人的视图"""
+    if not is_internal(request.scope):
+        raise HTTPException(403, "Internal endpoint")
+
+
+def _admin(request: Request):
+    """管理接口：其他 worker 的内部调用，或带着 STARTUPS_ADMIN_TOKEN 的请求"""
+    if is_internal(request.scope):
+        return
+    token = request.headers.get(ADMIN_HEADER, "")
+    if not ADMIN_TOKEN or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(403, "Admin token required")
 
 
 def _get_active_room(room_id: str) -> Room:
@@ -216,56 +619,322 @@ def _get_active_room(room_id: str) -> Room:
     room = rooms[room_id]
     if room.status != RoomStatus.active:
         raise HTTPException(400, "Game not active")
-    if room.game_state is None:
+    if room.game is None:
         raise HTTPException(500, "Game state missing")
     return room
 
 
+# ====== WebSocket 动作命令 ======
+# {"type": "action", "id": 请求号, "action": "draw" | "take" | "play", ...参数}
+# 执行成功回 {"type": "ack", "id", "seq"}，状态变更照常通过 action 广播下发；
+# 失败回 {"type": "error", "id", "code", "message"}，code 与对应 HTTP 接口的状态码一致。
+def _ws_params(message: dict) -> Tuple[str, dict]:
+    """取出动作名和参数，参数名与 HTTP 接口的查询参数相同"""
+    action = message.get("action")
+    if action == "draw":
+        return action, {}
+    if action == "take":
+        return action, {"card_index": int(message["card_index"])}
+    if action == "play":
+        play_type = message.get("play_type")
+        if play_type not in ("invest", "to_market"):
+            raise HTTPException(400, "play_type must be invest or to_market")
+        return action, {"card_company": str(message["card_company"]), "action": play_type}
+    raise HTTPException(400, f"Unknown action: {action}")
+
+
+async def _forward_action(room_id: str, player_id: str, action: str, params: dict) -> dict:
+    """房间在其他 worker 上时转给它的 HTTP 接口执行"""
+    query = urlencode({"room_id": room_id, "player_id": player_id, "delta": "true", **params})
+    status, _, payload = await forward_http(
+        cluster.socket_path(cluster.owner(room_id)),
+        "POST",
+        f"/room/action/{action}?{query}",
+        [],
+    )
+    body = json.loads(payload)
+    if status != 200:
+        raise HTTPException(status, body.get("detail", "Action failed"))
+    return body["data"]
+
+
+async def _ws_action(room_id: str, player_id: str, message: dict) -> dict:
+    request_id = message.get("id")
+    try:
+        action, params = _ws_params(message)
+        if cluster.owns(room_id):
+            _, patch = await _in_room(
+                room_id, _WS_COMMANDS[action], room_id, player_id, *params.values()
+            )
+        else:
+            patch = await _forward_action(room_id, player_id, action, params)
+    except HTTPException as e:
+        return {"type": "error", "id": request_id, "code": e.status_code, "message": e.detail}
+    except (KeyError, TypeError, ValueError):
+        return {"type": "error", "id": request_id, "code": 422, "message": "Malformed action"}
+    return {"type": "ack", "id": request_id, "seq": patch["seq"]}
+
+
 # ====== WebSocket 路由 ======
+# 所有 WebSocket 接口都经过 _limited 做连接数限制，用 _receive 读消息（带心跳超时）。
+# 同一玩家在同一房间只保留最新的一个连接：新连接登记后经控制频道通知所有 worker 关掉旧的。
+def _limited(endpoint):
+    """accept 之前检查连接数上限，超限直接拒绝（握手阶段返回 403）"""
+
+    @functools.wraps(endpoint)
+    async def run(websocket: WebSocket, **kwargs):
+        ip = websocket.client.host if websocket.client else "-"
+        refused = limiter.acquire(ip)
+        if refused is not None:
+            WS_REJECTED.inc(limit=refused)
+            await websocket.close(code=1013)
+            return
+        try:
+            await endpoint(websocket, **kwargs)
+        finally:
+            limiter.release(ip)
+
+    return run
+
+
+async def _receive(websocket: WebSocket) -> dict:
+    """下一条客户端消息（一定是 JSON 对象）；pong 只用来证明连接还活着，不返回
+
+    HEARTBEAT_TIMEOUT 秒内什么都没收到时抛出 asyncio.TimeoutError，半开的 TCP 连接也能发现。
+    不是 JSON 或者不是对象的帧记入 IGNORED 后跳过，不会把连接断掉。
+    """
+    while True:
+        text = await asyncio.wait_for(websocket.receive_text(), HEARTBEAT_TIMEOUT)
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            IGNORED.inc()
+            continue
+        if message.get("type") != "pong":
+            return message
+
+
+def _timed_out(conn):
+    WS_CLOSED.inc(reason="heartbeat")
+    conn.close(code=1001, reason="Heartbeat timeout")
+
+
+async def _heartbeat():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lagging = broadcaster.ping(PING)
+        if lagging:
+            WS_CLOSED.inc(lagging, reason="lagging")
+
+
+def _on_control(message: dict):
+    if message.get("type") == "replace":
+        replaced = broadcaster.replace(
+            message["room_id"],
+            message["player"],
+            message["keep"],
+            4001,
+            "Replaced by new connection",
+        )
+        if replaced:
+            WS_CLOSED.inc(replaced, reason="replaced")
+
+
+async def _lobby_state() -> dict:
+    query = f"/room/list?limit={LOBBY_SNAPSHOT_LIMIT}"
+    if cluster.enabled:
+        pages = [page or [] for page in await fetch_all(cluster, query)]
+    else:
+        pages = [rooms.list(limit=LOBBY_SNAPSHOT_LIMIT)]
+    return lobby_state(pages, LOBBY_SNAPSHOT_LIMIT)
+
+
+@app.websocket("/lobby")
+@_limited
+async def lobby_endpoint(websocket: WebSocket):
+    """大厅推送：先下发 lobby_state 快照，之后是合并过的 lobby_update"""
+    await websocket.accept()
+    # 先订阅再取快照，快照之前到达的变化不会比快照新
+    conn = broadcaster.add(LOBBY_CHANNEL, websocket)
+    bus.subscribe(LOBBY_CHANNEL)
+    try:
+        broadcaster.send(conn, await _lobby_state())
+        while True:
+            message = await _receive(websocket)
+            if message.get("type") == "sync":
+                broadcaster.send(conn, await _lobby_state())
+                continue
+            IGNORED.inc()
+    except WebSocketDisconnect:
+        pass
+    except asyncio.TimeoutError:
+        _timed_out(conn)
+    finally:
+        broadcaster.remove(LOBBY_CHANNEL, websocket)
+        if LOBBY_CHANNEL not in broadcaster.connections:
+            bus.unsubscribe(LOBBY_CHANNEL)
+
+
+async def _load_events(
+    room_id: str, player_name: str, since: int, epoch: Optional[str]
+) -> Optional[List[str]]:
+    """玩家错过的广播（序号大于 since），epoch 对不上、不在重放缓冲里或玩家不在房间时返回 None"""
+    if epoch is None:
+        return None
+    if cluster.owns(room_id):
+        room = rooms.get(room_id)
+        if room is None or player_name not in room.players:
+            return None
+        return _get_stream(room_id).since(since, epoch, player_name)
+    query = urlencode({"since": since, "epoch": epoch, "player": player_name})
+    data = await fetch_json(cluster, room_id, f"/room/{room_id}/events?{query}")
+    return None if data is None else data["events"]
+
+
+async def _load_session(room_id: str, token: str) -> Optional[str]:
+    """令牌对应的玩家名；会话表在房间所在的 worker 上，其他分片的房间向它查"""
+    if cluster.owns(room_id):
+        return _session_player(room_id, token)
+    query = urlencode({"token": token})
+    data = await fetch_json(cluster, room_id, f"/room/{room_id}/session?{query}")
+    return None if data is None else data["player"]
+
+
+def _release_room_channel(room_id: str):
+    """本 worker 上既没有玩家连接也没有观众时退订房间频道"""
+    if room_id not in broadcaster.connections and not spectators.watching(room_id):
+        bus.unsubscribe(room_id)
+
+
+# 要注册在 /{room_id}/{player_name} 之前，否则会被当成房间 "spectate"
+@app.websocket("/spectate/{room_id}")
+@_limited
+async def spectate_endpoint(websocket: WebSocket, room_id: str):
+    """观战：只读的公开视图，先下发 room_state，之后是合并过的 spectate 帧"""
+    await websocket.accept()
+    channel = spectator_channel(room_id)
+    conn = broadcaster.add(channel, websocket)
+    try:
+        if not spectators.watching(room_id):
+            # 第一位观众：先开始缓冲再取快照，取快照期间到达的广播不会丢
+            spectators.open(room_id)
+            bus.subscribe(room_id)
+            snapshot = await _load_snapshot(room_id)
+            if snapshot is None:
+                spectators.close(room_id)
+                broadcaster.close_room(channel, 1008, "Room not found")
+                return
+            spectators.seed(room_id, snapshot)
+        else:
+            snapshot = spectators.snapshot(room_id)
+            if snapshot is not None:
+                conn.offer(snapshot)
+
+        while True:
+            message = await _receive(websocket)
+            if message.get("type") == "sync":
+                snapshot = spectators.snapshot(room_id)
+                if snapshot is not None:
+                    conn.offer(snapshot)
+                continue
+            IGNORED.inc()
+    except WebSocketDisconnect:
+        pass
+    except asyncio.TimeoutError:
+        _timed_out(conn)
+    finally:
+        broadcaster.remove(channel, websocket)
+        if channel not in broadcaster.connections:
+            spectators.close(room_id)
+        _release_room_channel(room_id)
+
+
 @app.websocket("/{room_id}/{player_name}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, player_name: str):
+@_limited
+async def websocket_endpoint(
+    websocket: WebSocket,
+    room_id: str,
+    player_name: str,
+    token: Optional[str] = None,
+    since: Optional[int] = None,
+    epoch: Optional[str] = None,
+):
+    """token 为加入房间时拿到的会话令牌，必须与路径里的玩家名对应；
+    since / epoch 为客户端最后收到的序号和它所属的 epoch：断线重连时只补发错过的广播，
+    补不上（或者服务端重启过、epoch 变了）再发快照
+    """
     await websocket.accept()
-    if room_id not in rooms or player_name not in rooms[room_id].players:
-        await websocket.close(code=1008, reason="Player not in room")
+    if token is None or await _load_session(room_id, token) != player_name:
+        await websocket.close(code=1008, reason="Invalid session token")
         return
-    # 初始化连接池
-    if room_id not in websocket_connections:
-        websocket_connections[room_id] = set()
-    websocket_connections[room_id].add(websocket)
+    events = None if since is None else await _load_events(room_id, player_name, since, epoch)
+    if events is None:
+        snapshot = await _load_snapshot(room_id, player_name)
+        if snapshot is None or player_name not in _snapshot_players(snapshot):
+            await websocket.close(code=1008, reason="Player not in room")
+            return
+    conn = broadcaster.add(room_id, websocket, player_name)
+    bus.subscribe(room_id)
+    bus.subscribe(player_channel(room_id, player_name))
+    bus.publish(
+        CONTROL_CHANNEL,
+        dumps_text({"type": "replace", "room_id": room_id, "player": player_name, "keep": conn.id}),
+    )
+    rooms.mark_active(room_id)
 
     try:
-        if room_id in rooms:
-            room = rooms[room_id]
-            await asyncio.create_task(
-                broadcast_to_room(
-                    room_id, {"type": "room_state", "data": room.model_dump()}
-                )
-            )
+        if events is not None:
+            RESUMES.inc(result="replay")
+            for text in events:
+                conn.offer(text)
+        elif _snapshot_status(snapshot) == RoomStatus.waiting.value:
+            # 等待中的房间通过快照同步玩家列表
+            broadcast_to_room(room_id, snapshot)
+        else:
+            if since is not None:
+                RESUMES.inc(result="snapshot")
+            broadcaster.send(conn, snapshot)
 
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            print(message)
+            message = await _receive(websocket)
+            if message.get("type") == "sync":
+                # 客户端带上最后收到的序号和 epoch：补发错过的广播，补不上时发快照
+                seq, seq_epoch = message.get("seq"), message.get("epoch")
+                events = None
+                if isinstance(seq, int) and isinstance(seq_epoch, str):
+                    events = await _load_events(room_id, player_name, seq, seq_epoch)
+                if events is not None:
+                    for text in events:
+                        conn.offer(text)
+                    continue
+                snapshot = await _load_snapshot(room_id, player_name)
+                if snapshot is not None:
+                    broadcaster.send(conn, snapshot)
+                continue
+            if message.get("type") == "action":
+                broadcaster.send(conn, await _ws_action(room_id, player_name, message))
+                continue
+            IGNORED.inc()
 
     except WebSocketDisconnect:
         pass
+    except asyncio.TimeoutError:
+        _timed_out(conn)
     finally:
-        # 清理连接
-        if room_id in websocket_connections:
-            websocket_connections[room_id].discard(websocket)
-            if not websocket_connections[room_id]:
-                del websocket_connections[room_id]
+        # 清理连接，本 worker 上没有这个房间的连接后退订
+        broadcaster.remove(room_id, websocket)
+        _release_room_channel(room_id)
+        if player_channel(room_id, player_name) not in broadcaster.connections:
+            bus.unsubscribe(player_channel(room_id, player_name))
+        rooms.mark_active(room_id)
 
 
 # ====== 房间管理接口（同前，略作调整以触发广播）======
-
-
-@app.post("/room/create")
-def create_room(host_player_name: str):
-    if not host_player_name.strip():
-        raise HTTPException(400, "Player ID required")
-    # room_id = str(uuid.uuid4())[:8]
-    room_id = "123456"
+@_instrumented("create")
+def _create_room(room_id: str, host_player_name: str):
+    room_ids.release(room_id)
     room = Room(
         room_id=room_id,
         host_player_name=host_player_name,
@@ -273,27 +942,39 @@ def create_room(host_player_name: str):
         status=RoomStatus.waiting,
     )
     rooms[room_id] = room
-    return Response(data={"room_id": room_id})
+    room_streams.pop(room_id, None)
+    sessions.drop_room(room_id)
+    token = sessions.issue(room_id)
+    if store is not None:
+        store.delete(room_id)
+    _log(room, "create", {"room_id": room_id, "host": host_player_name, "token": token})
+    return ok({"room_id": room_id, "token": token})
+
+
+@app.post("/room/create")
+async def create_room(host_player_name: str):
+    if not host_player_name.strip():
+        raise HTTPException(400, "Player ID required")
+    room_id = room_ids.allocate(rooms)
+    return await _in_room(room_id, _create_room, room_id, host_player_name)
 
 
 @app.get("/room/list")
-def list_rooms():
-    data = [
-        {
-            "room_id": r.room_id,
-            "host": r.host_player_name,
-            "players": r.players,
-            "max_players": r.max_players,
-            "status": r.status,
-        }
-        for r in rooms.values()
-        if r.status != RoomStatus.finished
-    ]
-    return Response(data=data)
+async def list_rooms(
+    status: Optional[RoomStatus] = None,
+    player: Optional[str] = None,
+    cursor: str = "",
+    limit: int = Query(50, ge=1, le=200),
+):
+    """按创建顺序分页列出房间，默认只列未结束的房间
 
+    翻页时把上一页最后一条的 cursor 传回来；返回条数少于 limit 说明没有下一页了。
+    """
+    return ok(rooms.list(status and status.value, player, cursor, limit))
 
-@app.post("/room/join")
-async def join_room(room_id: str, player_name: str):
+
+@_instrumented("join")
+def _join_room(room_id: str, player_name: str):
     if room_id not in rooms:
         raise HTTPException(404, "游戏房间不存在!")
     room = rooms[room_id]
@@ -304,11 +985,24 @@ async def join_room(room_id: str, player_name: str):
     if len(room.players) >= room.max_players:
         raise HTTPException(400, "房间已满!")
     room.players.append(player_name)
-    return Response(data=room)
+    rooms.touch(room)
+    token = sessions.issue(room_id)
+    _log(room, "join", {"player": player_name, "token": token})
+    # 房间里已经连上的玩家直接收到新的玩家列表，不用轮询
+    broadcast_to_room(room_id, _snapshot(room))
+    # 在房间信息里附上令牌，之后的请求用它代替玩家名
+    data = room.model_dump(mode="json")
+    data["token"] = token
+    return ok(data)
 
 
-@app.post("/room/leave")
-def leave_room(room_id: str, player_name: str):
+@app.post("/room/join")
+async def join_room(room_id: str, player_name: str):
+    return await _in_room(room_id, _join_room, room_id, player_name)
+
+
+@_instrumented("leave")
+def _leave_room(room_id: str, player_name: str):
     if room_id not in rooms:
         raise HTTPException(404, "Room not found")
     room = rooms[room_id]
@@ -316,17 +1010,29 @@ def leave_room(room_id: str, player_name: str):
         raise HTTPException(400, "Not in room")
     if room.status != RoomStatus.waiting:
         raise HTTPException(400, "Cannot leave after game started")
-    room.players.remove(player_name)
-    if player_name == room.host_player_name and room.players:
-        room.host_player_name = room.players[0]
+    _remove_player(room, player_name)
     if not room.players:
+        sessions.drop_room(room_id)
         del rooms[room_id]
-        return Response(data=room)
-    return Response(data=room)
+        room_streams.pop(room_id, None)
+        if store is not None:
+            store.delete(room_id)
+        return ok(room)
+    _log(room, "leave", {"player": player_name})
+    broadcast_to_room(room_id, _snapshot(room))
+    return ok(room)
 
 
-@app.post("/room/start")
-async def start_game(room_id: str, host_player_name: str):
+@app.post("/room/leave")
+async def leave_room(
+    room_id: str, player_name: Optional[str] = None, token: Optional[str] = None
+):
+    player_name = _player_of(room_id, player_name, token)
+    return await _in_room(room_id, _leave_room, room_id, player_name)
+
+
+@_instrumented("start")
+def _start_game(room_id: str, host_player_name: str):
     if room_id not in rooms:
         raise HTTPException(404, "Room not found")
     room = rooms[room_id]
@@ -339,201 +1045,499 @@ async def start_game(room_id: str, host_player_name: str):
     if room.status != RoomStatus.waiting:
         raise HTTPException(400, "Game already started")
     try:
-        game_state = _create_game_state(room.players)
-        room.game_state = game_state
+        room.game = Game(room.players)
         room.status = RoomStatus.active
-        await asyncio.create_task(
-            broadcast_to_room(
-                room_id,
-                {
-                    "type": "game_started",
-                    "data": room,
-                },
-            )
+        rooms.touch(room)
+        _log(room, "start", {"seed": room.game.seed})
+        stream = _get_stream(room_id)
+        _set_game_state(stream, room.game)
+        stream.set(["status"], room.status.value)
+        patch = stream.commit()
+        # 公开的房间给所有人，各自的手牌随后单独发
+        broadcast_to_room(
+            room_id,
+            {
+                "type": "game_started",
+                "seq": patch["seq"],
+                "data": room,
+            },
+            seq=patch["seq"],
         )
-        return Response(data=room)
+        _send_private(room_id, patch)
+        return ok(_room_view(room, host_player_name))
     except Exception as e:
         raise HTTPException(500, f"Game init failed: {e}")
 
 
-@app.delete("/room/delete")
-def delete_room(room_id: str, player_name: str):
+@app.post("/room/start")
+async def start_game(
+    room_id: str, host_player_name: Optional[str] = None, token: Optional[str] = None
+):
+    host_player_name = _player_of(room_id, host_player_name, token)
+    return await _in_room(room_id, _start_game, room_id, host_player_name)
+
+
+@_instrumented("delete")
+def _delete_room(room_id: str, player_name: str):
     if room_id not in rooms:
         raise HTTPException(404, "Room not found")
     room = rooms[room_id]
     if room.status == RoomStatus.waiting or player_name == room.host_player_name:
+        sessions.drop_room(room_id)
         del rooms[room_id]
-        asyncio.create_task(
-            broadcast_to_room(room_id, {"type": "room_deleted", "data": {}})
-        )
-        return Response()
+        room_streams.pop(room_id, None)
+        if store is not None:
+            store.delete(room_id)
+        broadcast_to_room(room_id, {"type": "room_deleted", "data": {}})
+        return ok()
     raise HTTPException(403, "Cannot delete active room")
 
 
+@app.delete("/room/delete")
+async def delete_room(
+    room_id: str, player_name: Optional[str] = None, token: Optional[str] = None
+):
+    player_name = _player_of(room_id, player_name, token)
+    return await _in_room(room_id, _delete_room, room_id, player_name)
+
+
 @app.get("/room/{room_id}")
-def get_room(room_id: str):
+async def get_room(room_id: str, token: Optional[str] = None):
+    """不带令牌时返回公开视图，带会话令牌时附带令牌所属玩家自己的手牌"""
     if room_id not in rooms:
         raise HTTPException(404, "Room not found")
-    return Response(data=rooms[room_id])
+    viewer = None if token is None else _player_of(room_id, None, token)
+    return ok(_room_view(rooms[room_id], viewer))
 
 
-@app.post("/room/action/draw")
-def draw_from_deck(room_id: str, player_id: str):
-    room = _get_active_room(room_id)
-    game = room.game_state
-    if game.current_player_id != player_id:
-        raise HTTPException(400, "Not your turn")
-    if len(game.players[player_id].hand) != 3:
-        raise HTTPException(400, "Hand must have 3 cards before drawing")
-    if not game.market_deck:
-        raise HTTPException(400, "Deck is empty")
-
-    cost = sum(
-        1
-        for mc in game.market_display
-        if not game.players[player_id].has_antimonopoly[mc.company]
-    )
-    if game.players[player_id].money < cost:
-        raise HTTPException(400, f"Need {cost} money")
+@app.get("/room/{room_id}/snapshot")
+async def get_room_snapshot(request: Request, room_id: str, player: Optional[str] = None):
+    """带序号的完整快照，与 WebSocket 下发的 room_state 消息相同
 
-    # game.market_deck.remove(card)
-    card = game.market_deck.pop()
-    game.players[player_id].money -= cost
-    game.players[player_id].hand.append(card)
+    player 不经令牌校验，只接受其他 worker 发起的内部查询（WebSocket 已经验过令牌）。
+    """
+    _internal(request)
+    if room_id not in rooms:
+        raise HTTPException(404, "Room not found")
+    # 连在其他 worker 上的 WebSocket 通过这个接口取快照，也算房间有活动
+    rooms.mark_active(room_id)
+    return ok(_snapshot(rooms[room_id], player))
 
-    # 广播动作
-    asyncio.create_task(
-        broadcast_to_room(
-            room_id,
-            {
-                "type": "action",
-                "data": {
-                    "player_id": player_id,
-                    "action": "draw_from_deck",
-                    "card": card,
-                    "money_spent": cost,
-                    "money_left": game.players[player_id].money,
-                },
+
+@app.get("/room/{room_id}/events")
+async def get_room_events(
+    request: Request, room_id: str, since: int, epoch: str, player: Optional[str] = None
+):
+    """序号大于 since 的已编码广播；epoch 对不上或者已经不在重放缓冲里时返回 410，客户端改用快照
+
+    与 /snapshot 一样只接受其他 worker 发起的内部查询。
+    """
+    _internal(request)
+    room = rooms.get(room_id)
+    if room is None:
+        raise HTTPException(404, "Room not found")
+    if player is not None and player not in room.players:
+        raise HTTPException(403, "Player not in room")
+    stream = _get_stream(room_id)
+    events = stream.since(since, epoch, player)
+    if events is None:
+        raise HTTPException(410, "Too far behind, fetch a snapshot")
+    rooms.mark_active(room_id)
+    return ok({"seq": stream.seq, "events": events})
+
+
+@app.get("/room/{room_id}/session")
+async def get_session(request: Request, room_id: str, token: str):
+    """令牌对应的玩家名，连在其他 worker 上的 WebSocket 用它验证令牌"""
+    _internal(request)
+    player = _session_player(room_id, token)
+    if player is None:
+        raise HTTPException(401, "Invalid session token")
+    return ok({"player": player})
+
+
+@app.get("/room/{room_id}/legal")
+async def get_legal_moves(room_id: str, token: str):
+    """玩家现在能做的动作，与引擎校验动作用的是同一份；没轮到他时 phase 为 wait
+
+    可以投资的公司就是他手里的牌，所以要凭会话令牌查看。
+    """
+    room = rooms.get(room_id)
+    if room is None:
+        raise HTTPException(404, "Room not found")
+    player_id = _player_of(room_id, None, token)
+    if room.game is None:
+        raise HTTPException(400, "Game not started")
+    seat = room.game.seat(player_id)
+    if seat == NO_PLAYER:
+        raise HTTPException(403, "Player not in room")
+    return ok(room.game.legal_dict(seat))
+
+
+# ====== 对局重放 ======
+# 牌局状态只由种子和动作记录决定，任意一步的状态都能现场重放出来（一整局约 1ms）。
+# 种子能推出所有人的手牌，进行中只给公开视图，完整记录等对局结束后才公开。
+@app.get("/room/{room_id}/replay")
+async def get_room_replay(room_id: str, step: Optional[int] = None):
+    """第 step 个动作之后的公开视图，观战拖动进度条用；不给 step 时是当前状态"""
+    room = rooms.get(room_id)
+    if room is None:
+        raise HTTPException(404, "Room not found")
+    game = room.game
+    if game is None:
+        raise HTTPException(400, "Game not started")
+    log = bytes(game.log)
+    total = steps(log)
+    step = total if step is None else max(0, min(step, total))
+    past = replay(game.player_ids, game.seed, log, step)
+    return ok({"step": step, "steps": total, "game_state": past.view()})
+
+
+@app.get("/room/{room_id}/record")
+async def get_room_record(room_id: str):
+    """结束的对局的种子和动作记录，python -m replay 可以用它复现整局
+
+    归档在 SQLite 里，连接只能在事件循环线程里用，所以这个接口是 async 的。
+    """
+    room = rooms.get(room_id)
+    if room is not None:
+        if room.status != RoomStatus.finished or room.game is None:
+            raise HTTPException(403, "Game not finished")
+        return ok(game_record(room.game))
+    archived = store.find_archived(room_id) if store is not None else None
+    if archived is None:
+        raise HTTPException(404, "Record not found")
+    return ok({key: archived[key] for key in ("game_id", "player_ids", "seed", "log")})
+
+
+@_instrumented("draw")
+def _draw_from_deck(room_id: str, player_id: str):
+    room = _get_active_room(room_id)
+    game = room.game
+    seat = game.seat(player_id)
+    try:
+        card, cost = game.draw(seat)
+    except RuleError as e:
+        raise HTTPException(400, str(e))
+    _log(room, "draw", {"player": player_id})
+
+    stream = _get_stream(room_id)
+    stream.set(["game_state", "market_deck_size"], len(game.deck))
+    stream.set(["game_state", "players", player_id, "money"], game.money[seat])
+    _set_hand_size(stream, game, seat)
+    stream.push(["game_state", "players", player_id, "hand"], COMPANIES[card], to=player_id)
+    patch = stream.commit()
+
+    # 广播动作；抽到的牌只告诉抽牌的人
+    broadcast_to_room(
+        room_id,
+        {
+            "type": "action",
+            "seq": patch["seq"],
+            "ops": patch["ops"],
+            "data": {
+                "player_id": player_id,
+                "action": "draw_from_deck",
+                "money_spent": cost,
+                "money_left": game.money[seat],
             },
-        )
+        },
+        seq=patch["seq"],
     )
-    return Response(data=room)
+    _send_private(room_id, patch, {player_id: {"card": COMPANIES[card]}})
+    return room, patch
 
 
-@app.post("/room/action/take")
-def take_from_market(room_id: str, player_id: str, card_index: int):
+@app.post("/room/action/draw")
+async def draw_from_deck(
+    room_id: str,
+    player_id: Optional[str] = None,
+    token: Optional[str] = None,
+    delta: bool = False,
+):
+    player_id = _player_of(room_id, player_id, token)
+    viewer = None if token is None else player_id
+    return await _in_room(room_id, _respond, delta, viewer, _draw_from_deck, room_id, player_id)
+
+
+@_instrumented("take")
+def _take_from_market(room_id: str, player_id: str, card_index: int):
     room = _get_active_room(room_id)
-    game = room.game_state
-    if game.current_player_id != player_id:
-        raise HTTPException(400, "Not your turn")
-    if len(game.players[player_id].hand) != 3:
-        raise HTTPException(400, "Hand must have 3 cards before taking")
-    if card_index < 0 or card_index >= len(game.market_display):
-        raise HTTPException(400, "Invalid card index")
-
-    market_card = game.market_display[card_index]
-    company = market_card.company
-
-    if game.players[player_id].has_antimonopoly[company]:
-        raise HTTPException(400, f"You hold anti-monopoly token for {company}")
-
-    game.players[player_id].hand.append(company)
-    coins = market_card.coins_on_top
-    game.players[player_id].money += coins
-    game.market_display.pop(card_index)
-
-    asyncio.create_task(
-        broadcast_to_room(
-            room_id,
-            {
-                "type": "action",
-                "data": {
-                    "player_id": player_id,
-                    "action": "take_from_market",
-                    "company": company,
-                    "coins_gained": coins,
-                },
+    game = room.game
+    seat = game.seat(player_id)
+    try:
+        company, coins = game.take(seat, card_index)
+    except RuleError as e:
+        raise HTTPException(400, str(e))
+    _log(room, "take", {"player": player_id, "index": card_index})
+
+    stream = _get_stream(room_id)
+    stream.pop(["game_state", "market_display"], card_index)
+    stream.set(["game_state", "players", player_id, "money"], game.money[seat])
+    _set_hand_size(stream, game, seat)
+    stream.push(["game_state", "players", player_id, "hand"], COMPANIES[company], to=player_id)
+    patch = stream.commit()
+
+    broadcast_to_room(
+        room_id,
+        {
+            "type": "action",
+            "seq": patch["seq"],
+            "ops": patch["ops"],
+            "data": {
+                "player_id": player_id,
+                "action": "take_from_market",
+                "company": COMPANIES[company],
+                "coins_gained": coins,
             },
-        )
+        },
+        seq=patch["seq"],
     )
+    _send_private(room_id, patch)
 
-    return Response(data=room)
+    return room, patch
 
 
-@app.post("/room/action/play")
-def play_card(
+@app.post("/room/action/take")
+async def take_from_market(
+    room_id: str,
+    card_index: int,
+    player_id: Optional[str] = None,
+    token: Optional[str] = None,
+    delta: bool = False,
+):
+    player_id = _player_of(room_id, player_id, token)
+    viewer = None if token is None else player_id
+    return await _in_room(
+        room_id, _respond, delta, viewer, _take_from_market, room_id, player_id, card_index
+    )
+
+
+@_instrumented("play")
+def _play_card(
     room_id: str,
     player_id: str,
     card_company: str,
     action: Literal["invest", "to_market"],
 ):
     room = _get_active_room(room_id)
-    game = room.game_state
-    if game.current_player_id != player_id:
-        raise HTTPException(400, "Not your turn")
-    if card_company not in game.players[player_id].hand:
+    game = room.game
+    seat = game.seat(player_id)
+    company = COMPANY_INDEX.get(card_company)
+    if company is None:
         raise HTTPException(400, "Card not in hand")
+    old_owner = game.owner_id(company)
+    try:
+        hand_index, triggered_end = game.play(seat, company, action == "invest")
+    except RuleError as e:
+        raise HTTPException(400, str(e))
+    _finish_if_over(room)
+    _log(
+        room,
+        "play",
+        {"player": player_id, "company": card_company, "invest": action == "invest"},
+    )
 
-    game.players[player_id].hand.remove(card_company)
-
-    if action == "invest":
-        game.players[player_id].investments[card_company] += 1
-        if game.antimonopoly_owner[card_company] is None:
-            game.antimonopoly_owner[card_company] = player_id
-            game.players[player_id].has_antimonopoly[card_company] = True
-        _update_antimonopoly_token(game, card_company)
-    elif action == "to_market":
-        if game.players[player_id].has_antimonopoly[card_company]:
-            raise HTTPException(400, f"Cannot put {card_company} on market")
-        game.market_display.append(MarketCard(company=card_company))
-
-    # 检查回合结束
-    triggered_end = False
-    if len(game.market_deck) == 0:
-        _end_round(game)
-        triggered_end = True
-        if game.status == "game_over":
-            room.status = RoomStatus.finished
-            asyncio.create_task(
-                broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "game_over",
-                        "data": {
-                            "final_scores": {
-                                pid: p.score for pid, p in game.players.items()
-                            },
-                            "winner": max(
-                                game.players.items(), key=lambda x: x[1].score
-                            )[0],
-                        },
-                    },
-                )
+    stream = _get_stream(room_id)
+    game_over_msg = None
+    if triggered_end:
+        # 回合结算改动面太大，直接下发整个 game_state
+        _set_game_state(stream, game)
+        if room.status == RoomStatus.finished:
+            stream.set(["status"], room.status.value)
+            game_over_msg = {
+                "type": "game_over",
+                "data": {
+                    "final_scores": game.final_scores(),
+                    "winner": game.winner(),
+                    "seed": game.seed,
+                },
+            }
+    else:
+        stream.pop(["game_state", "players", player_id, "hand"], hand_index, to=player_id)
+        _set_hand_size(stream, game, seat)
+        if action == "invest":
+            stream.set(
+                ["game_state", "players", player_id, "investments", card_company],
+                game.holding(seat, company),
             )
-
-    # 切换玩家
-    if game.status != "game_over":
-        player_list = list(game.players.keys())
-        idx = player_list.index(game.current_player_id)
-        game.current_player_id = player_list[(idx + 1) % len(player_list)]
+            _record_antimonopoly(stream, game, company, old_owner)
+        else:
+            stream.push(
+                ["game_state", "market_display"],
+                {"company": card_company, "coins_on_top": 0},
+            )
+        stream.set(["game_state", "current_player_id"], game.player_ids[game.current])
+    patch = stream.commit()
 
     # 广播动作
     msg = {
         "type": "action",
+        "seq": patch["seq"],
+        "ops": patch["ops"],
         "data": {
             "player_id": player_id,
             "action": "play_card",
             "card_company": card_company,
             "play_type": action,
             "new_current_player": (
-                game.current_player_id if game.status != "game_over" else None
+                game.player_ids[game.current] if game.status != "game_over" else None
             ),
             "round_ended": triggered_end and game.status != "game_over",
         },
     }
-    asyncio.create_task(broadcast_to_room(room_id, msg))
+    broadcast_to_room(room_id, msg, seq=patch["seq"])
+    _send_private(room_id, patch)
+    if game_over_msg:
+        broadcast_to_room(room_id, game_over_msg, seq=patch["seq"])
+
+    return room, patch
+
 
-    return Response(data=room)
+@app.post("/room/action/play")
+async def play_card(
+    room_id: str,
+    card_company: str,
+    action: Literal["invest", "to_market"],
+    player_id: Optional[str] = None,
+    token: Optional[str] = None,
+    delta: bool = False,
+):
+    player_id = _player_of(room_id, player_id, token)
+    viewer = None if token is None else player_id
+    return await _in_room(
+        room_id, _respond, delta, viewer, _play_card, room_id, player_id, card_company, action
+    )
+
+
+_WS_COMMANDS = {
+    "draw": _draw_from_deck,
+    "take": _take_from_market,
+    "play": _play_card,
+}
+
+
+# ====== 闲置房间回收 ======
+def _expired(room: Room, idle: float, connected: Collection[str] = ()) -> bool:
+    """connected 是其他 worker 上还有玩家连接的房间"""
+    if room.status != RoomStatus.finished and (
+        room.room_id in broadcaster.connections or room.room_id in connected
+    ):
+        return False
+    return idle >= ROOM_TTL[room.status.value]
+
+
+def _archive_record(room: Room) -> dict:
+    """结束的对局只保留结果，以及重放整局用的种子和动作记录"""
+    game = room.game
+    return {
+        "room_id": room.room_id,
+        "players": room.players,
+        "final_scores": game.final_scores(),
+        "winner": game.winner(),
+        "rounds": game.round_number,
+        **game_record(game),
+    }
+
+
+@_instrumented("evict")
+def _evict_room(room_id: str, connected: Collection[str] = ()) -> bool:
+    """在房间 actor 里再确认一次确实过期了再回收，避免和刚到的命令冲突"""
+    room = rooms.get(room_id)
+    if room is None or not _expired(
+        room, time.monotonic() - rooms.last_active[room_id], connected
+    ):
+        return False
+    status = room.status.value
+    if store is not None:
+        if room.status == RoomStatus.finished and room.game is not None:
+            store.archive(room_id, _archive_record(room))
+        else:
+            store.delete(room_id)
+    sessions.drop_room(room_id)
+    del rooms[room_id]
+    room_streams.pop(room_id, None)
+    broadcast_to_room(room_id, {"type": "room_deleted", "data": {"reason": "expired"}})
+    broadcaster.close_room(room_id, 1001, "Room expired")
+    EVICTED.inc(status=status)
+    return True
+
+
+# 每次向其他 worker 询问的房间数，查询串不超过 h11 的请求行上限
+CONNECTED_QUERY_BATCH = 500
+
+
+@app.get("/cluster/connected")
+async def connected_rooms(request: Request, room_ids: str = ""):
+    """逗号分隔的房间号里，本 worker 上还有玩家连接的那些；回收前用来向各个 worker 确认"""
+    _internal(request)
+    return ok([room_id for room_id in room_ids.split(",") if room_id in broadcaster.connections])
+
+
+async def _connected_elsewhere(room_ids: List[str]) -> Optional[Set[str]]:
+    """各个 worker 上还有玩家连接的房间；有 worker 没有回应时返回 None，这一轮只回收结束的房间"""
+    if not cluster.enabled:
+        return set()
+    connected: Set[str] = set()
+    for i in range(0, len(room_ids), CONNECTED_QUERY_BATCH):
+        query = urlencode({"room_ids": ",".join(room_ids[i : i + CONNECTED_QUERY_BATCH])})
+        for page in await fetch_all(cluster, f"/cluster/connected?{query}"):
+            if page is None:
+                return None
+            connected.update(page)
+    return connected
+
+
+async def _reap() -> int:
+    """回收所有过期的房间，返回回收的数量"""
+    evicted = 0
+    idle = [room_id for room_id, _ in rooms.idle(min(ROOM_TTL.values()))]
+    if not idle:
+        return 0
+    connected = await _connected_elsewhere(idle)
+    for room_id in idle:
+        room = rooms.get(room_id)
+        if connected is None and (room is None or room.status != RoomStatus.finished):
+            continue
+        try:
+            evicted += await _in_room(
+                room_id, _evict_room, room_id, connected or (), touch=False
+            )
+        except HTTPException:
+            # 房间命令队列满了，说明并不闲，下次再看
+            pass
+    return evicted
+
+
+async def _reaper():
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        await _reap()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/profile")
+def profile(top: int = 10):
+    """采样分析器的结果：每个房间的样本数和最热的函数"""
+    return ok(SAMPLER.report(top))
+
+
+@app.post("/metrics/profile")
+async def toggle_profile(request: Request, enable: bool, reset: bool = False):
+    """开关采样分析器；平时用 STARTUPS_PROFILE=1 在启动时打开"""
+    _admin(request)
+    if reset:
+        SAMPLER.reset()
+    if enable:
+        SAMPLER.start()
+    else:
+        SAMPLER.stop()
+    return ok(SAMPLER.report(0))
 
 
 @app.get("/")
@@ -541,7 +1545,21 @@ def root():
     return "服务启动成功"
 
 
+# 开发：python main.py，改代码自动重载
+# 生产：python main.py --production --host 0.0.0.0，不开重载；多 worker 用 python -m cluster
 if __name__ == "__main__":
+    import argparse
+
     from uvicorn import run
 
-    run(app="main:app", host="127.0.0.1", port=8080, reload=True)
+    parser = argparse.ArgumentParser(description="Startups 后端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--production", action="store_true", help="关闭自动重载")
+    args = parser.parse_args()
+    if args.production:
+        # 直接交给 uvicorn 已经建好的 app，不会再按 "main:app" 把整个模块导入一遍，
+        # 也不启动监视文件的重载进程
+        run(app, host=args.host, port=args.port, reload=False)
+    else:
+        run(app="main:app", host=args.host, port=args.port, reload=True)
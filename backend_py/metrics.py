@@ -0,0 +1,243 @@
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter as _Tally
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# ====== 指标 ======
+# Prometheus 文本格式的计数器/直方图/仪表盘，GET /metrics 输出。
+# 全部在事件循环线程里更新，不加锁；每次记录只是几次字典和列表操作。
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def samples(self) -> List[tuple]:
+        """(后缀, 标签值, 额外标签, 值) 列表"""
+        raise NotImplementedError
+
+    def render(self, const: Tuple[Tuple[str, str], ...]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        names = tuple(n for n, _ in const) + self.labels
+        for suffix, key, extra, value in self.samples():
+            values = tuple(v for _, v in const) + key
+            lines.append(f"{self.name}{suffix}{_label_str(names, values, extra)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [("", key, "", value) for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """当前值；给定 fn 时在输出时调用 fn() 取值"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        return [("", (), "", self.fn() if self.fn is not None else self.value)]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # key -> [每个桶的计数..., +Inf 桶的计数, sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self):
+        out = []
+        for key, row in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                out.append(("_bucket", key, f'le="{bound}"', cumulative))
+            cumulative += row[-2]
+            out.append(("_bucket", key, 'le="+Inf"', cumulative))
+            out.append(("_sum", key, "", row[-1]))
+            out.append(("_count", key, "", cumulative))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        # 附加在所有样本上的标签，例如多 worker 时的分片号
+        self.const_labels: Dict[str, str] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        const = tuple(self.const_labels.items())
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, fn))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+# ====== 采样分析器 ======
+_APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+def _where(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Sampler:
+    """按固定频率采样事件循环线程的调用栈，按房间统计热点函数
+
+    正在执行的房间命令通过 room 属性告知（事件循环是单线程的，同一时刻只有一个）；
+    不在命令里的样本记在 "-" 下。默认关闭，开销只在 start() 之后才有。
+    """
+
+    def __init__(self, hz: int = 100, depth: int = 32):
+        self.interval = 1.0 / hz
+        self.depth = depth
+        self.room: Optional[str] = None
+        self.samples: Dict[str, _Tally] = {}
+        self.room_samples: _Tally = _Tally()
+        self._target: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            room = self.room or "-"
+            tally = self.samples.get(room)
+            if tally is None:
+                tally = self.samples[room] = _Tally()
+            # 记录栈顶函数，以及调用它的最近一层本项目代码，库函数的耗时也能归到业务函数上
+            leaf = _where(frame.f_code)
+            caller = None
+            for _ in range(self.depth):
+                if frame is None:
+                    break
+                if frame.f_code.co_filename.startswith(_APP_DIR):
+                    caller = _where(frame.f_code)
+                    break
+                frame = frame.f_back
+            tally[leaf if caller in (None, leaf) else f"{leaf} < {caller}"] += 1
+            self.room_samples[room] += 1
+
+    def report(self, top: int = 10) -> dict:
+        # 采样线程可能正在写，先各拷贝一份
+        rooms = _Tally(dict(self.room_samples))
+        return {
+            "running": self.running,
+            "hz": round(1.0 / self.interval),
+            "samples": sum(rooms.values()),
+            "rooms": {
+                room: {
+                    "samples": n,
+                    "hot": dict(_Tally(dict(self.samples[room])).most_common(top)),
+                }
+                for room, n in rooms.most_common()
+            },
+        }
+
+    def reset(self):
+        self.samples.clear()
+        self.room_samples.clear()
+
+
+SAMPLER = Sampler()
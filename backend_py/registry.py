@@ -0,0 +1,175 @@
+import heapq
+import time
+from bisect import bisect_right, insort
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+# ====== 房间索引 ======
+# rooms 的替代品：照常按 room_id 存取，同时维护
+#   - 按状态的有序索引（按创建顺序），列表和分页不用扫描全部房间
+#   - 按玩家的索引
+#   - 大厅视图：每个房间一条预先生成好的列表条目，房间变化时增量更新
+# 房间的状态或玩家列表在原地修改后要调用 touch(room) 刷新。
+
+LISTED_STATUSES = ("waiting", "active")
+
+Listener = Callable[[str, Optional[dict]], None]
+
+
+def _status(room) -> str:
+    return getattr(room.status, "value", room.status)
+
+
+class RoomRegistry(MutableMapping):
+    """room_id -> Room
+
+    每个房间有一个 cursor：创建时间（纳秒，补零）加房间号，字符串顺序就是创建顺序，
+    分页时客户端把上一页最后一条的 cursor 传回来即可；多个 worker 的结果也能按它直接归并。
+    """
+
+    def __init__(self):
+        self._rooms: Dict[str, object] = {}
+        self._cursors: Dict[str, str] = {}
+        # status -> 有序的 cursor 列表；cursor -> room_id
+        self.by_status: Dict[str, List[str]] = {}
+        self._cursor_room: Dict[str, str] = {}
+        # player -> {room_id}
+        self.by_player: Dict[str, Set[str]] = {}
+        # room_id -> 大厅条目，以及建立索引时的 (status, players)
+        self.entries: Dict[str, dict] = {}
+        self._indexed: Dict[str, tuple] = {}
+        # 大厅条目变化时回调 (room_id, 条目)，房间删除时条目为 None
+        self.listeners: List[Listener] = []
+        # room_id -> 最近一次活动的 time.monotonic()，最久没有活动的排在最前
+        self.last_active: "OrderedDict[str, float]" = OrderedDict()
+
+    # ---- Mapping 接口 ----
+    def __getitem__(self, room_id: str):
+        return self._rooms[room_id]
+
+    def __contains__(self, room_id) -> bool:
+        return room_id in self._rooms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rooms)
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __setitem__(self, room_id: str, room):
+        if room_id in self._rooms:
+            self._unindex(room_id)
+        self._rooms[room_id] = room
+        self._cursors[room_id] = f"{time.time_ns():020d}-{room_id}"
+        self._index(room)
+        self.mark_active(room_id)
+
+    def __delitem__(self, room_id: str):
+        del self._rooms[room_id]
+        self._unindex(room_id)
+        del self._cursors[room_id]
+        del self.last_active[room_id]
+        self._notify(room_id, None)
+
+    # ---- 活动时间 ----
+    def mark_active(self, room_id: str):
+        if room_id in self._rooms:
+            self.last_active[room_id] = time.monotonic()
+            self.last_active.move_to_end(room_id)
+
+    def idle(self, min_idle: float) -> List[Tuple[str, float]]:
+        """闲置超过 min_idle 秒的 (room_id, 闲置秒数)，最久没有活动的在前
+
+        last_active 按活动时间排序，遇到第一个不够久的就可以停下。
+        """
+        now = time.monotonic()
+        found = []
+        for room_id, at in self.last_active.items():
+            if now - at < min_idle:
+                break
+            found.append((room_id, now - at))
+        return found
+
+    # ---- 索引维护 ----
+    def touch(self, room):
+        """房间的状态、房主或玩家列表变了之后调用；未登记的房间忽略"""
+        if self._rooms.get(room.room_id) is not room:
+            return
+        status, players = self._indexed[room.room_id]
+        if status != _status(room) or players != tuple(room.players):
+            self._unindex(room.room_id)
+            self._index(room)
+        else:
+            self._refresh_entry(room)
+
+    def _index(self, room):
+        room_id = room.room_id
+        cursor = self._cursors[room_id]
+        status = _status(room)
+        players = tuple(room.players)
+        insort(self.by_status.setdefault(status, []), cursor)
+        self._cursor_room[cursor] = room_id
+        for player in players:
+            self.by_player.setdefault(player, set()).add(room_id)
+        self._indexed[room_id] = (status, players)
+        self._refresh_entry(room)
+
+    def _unindex(self, room_id: str):
+        status, players = self._indexed.pop(room_id)
+        cursor = self._cursors[room_id]
+        ordered = self.by_status[status]
+        del ordered[bisect_right(ordered, cursor) - 1]
+        del self._cursor_room[cursor]
+        for player in players:
+            room_ids = self.by_player[player]
+            room_ids.discard(room_id)
+            if not room_ids:
+                del self.by_player[player]
+        self.entries.pop(room_id, None)
+
+    def _refresh_entry(self, room):
+        entry = {
+            "room_id": room.room_id,
+            "host": room.host_player_name,
+            "players": list(room.players),
+            "max_players": room.max_players,
+            "status": _status(room),
+            "cursor": self._cursors[room.room_id],
+        }
+        if self.entries.get(room.room_id) != entry:
+            self.entries[room.room_id] = entry
+            self._notify(room.room_id, entry)
+
+    def _notify(self, room_id: str, entry: Optional[dict]):
+        for listener in self.listeners:
+            listener(room_id, entry)
+
+    # ---- 查询 ----
+    def rooms_of(self, player: str) -> Set[str]:
+        return self.by_player.get(player, set())
+
+    def list(
+        self,
+        status: Optional[str] = None,
+        player: Optional[str] = None,
+        cursor: str = "",
+        limit: int = 50,
+    ) -> List[dict]:
+        """按创建顺序列出 cursor 之后的至多 limit 个房间；默认只列未结束的房间"""
+        statuses = (status,) if status else LISTED_STATUSES
+        if player is not None:
+            cursors = sorted(
+                self._cursors[room_id]
+                for room_id in self.rooms_of(player)
+                if self._indexed[room_id][0] in statuses
+            )
+            page = cursors[bisect_right(cursors, cursor) :][:limit]
+        else:
+            runs = []
+            for s in statuses:
+                ordered = self.by_status.get(s, [])
+                start = bisect_right(ordered, cursor)
+                runs.append(ordered[start : start + limit])
+            page = list(heapq.merge(*runs))[:limit]
+        return [self.entries[self._cursor_room[c]] for c in page]
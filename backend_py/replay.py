@@ -0,0 +1,89 @@
+# 从种子和动作记录重放一局游戏：观战拖动进度、复现 bug、回归测试都用它
+# 用法（在 backend_py 目录下）：
+#   python -m replay record.json [--step N]
+#   python -m replay --db startups.db --room ABC234 [--step N]
+# record.json 是 GET /room/{room_id}/record 的返回，或者归档表里的一条记录。
+import argparse
+import json
+import sys
+from typing import Iterator, List, Optional, Sequence
+
+from engine import ACTION_SIZE, OP_DRAW, OP_INVEST, OP_TAKE, Game
+
+
+def actions(log: bytes) -> Iterator[bytes]:
+    """按顺序拆出每个动作的 (操作, 座位, 参数)"""
+    for i in range(0, len(log), ACTION_SIZE):
+        yield log[i : i + ACTION_SIZE]
+
+
+def apply(game: Game, op: int, seat: int, arg: int):
+    if op == OP_DRAW:
+        game.draw(seat)
+    elif op == OP_TAKE:
+        game.take(seat, arg)
+    else:
+        game.play(seat, arg, op == OP_INVEST)
+
+
+def replay(
+    player_ids: Sequence[str], seed: int, log: bytes, step: Optional[int] = None
+) -> Game:
+    """重放出第 step 个动作之后的状态；step 为 None 时重放全部动作"""
+    game = Game(list(player_ids), seed=seed)
+    end = len(log) if step is None else min(len(log), step * ACTION_SIZE)
+    for op, seat, arg in actions(log[:end]):
+        apply(game, op, seat, arg)
+    return game
+
+
+def steps(log: bytes) -> int:
+    return len(log) // ACTION_SIZE
+
+
+def game_record(game: Game) -> dict:
+    """一局的完整记录：玩家、种子和动作，足够重放出每一步"""
+    return {
+        "game_id": game.game_id,
+        "player_ids": game.player_ids,
+        "seed": game.seed,
+        "log": game.log.hex(),
+    }
+
+
+def _load_record(args) -> dict:
+    if args.db:
+        from storage import RoomStore
+
+        store = RoomStore(args.db)
+        try:
+            data = store.find_archived(args.room)
+        finally:
+            store.close()
+        if data is None:
+            sys.exit(f"no record for room {args.room} in the archive")
+        return data
+    with open(args.record) as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="replay a game from its seed and action log")
+    parser.add_argument("record", nargs="?", help="json file with player_ids/seed/log")
+    parser.add_argument("--db", help="read the record from this database's archive")
+    parser.add_argument("--room", help="room id in the archive (with --db)")
+    parser.add_argument("--step", type=int, default=None, help="stop after this many actions")
+    args = parser.parse_args(argv)
+    if not args.record and not (args.db and args.room):
+        parser.error("give a record file, or --db and --room")
+
+    data = _load_record(args)
+    log = bytes.fromhex(data["log"])
+    total = steps(log)
+    step = total if args.step is None else max(0, min(args.step, total))
+    game = replay(data["player_ids"], data["seed"], log, step)
+    print(json.dumps({"step": step, "steps": total, "game": game.dump()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import random
+import secrets
+from typing import Callable, Container, Dict, List, NamedTuple, Optional, Set
+
+# ====== 房间号与会话令牌 ======
+# 房间号：6 位大写字母和数字，去掉容易看错的 0/O/1/I，约 10 亿个，口头报号也不容易出错。
+# 会话令牌：加入房间时签发的不透明字符串，O(1) 查到 (房间, 座位)，
+# 动作接口凭令牌识别玩家，不用再按名字在玩家列表里查找。
+
+ROOM_ID_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+ROOM_ID_LENGTH = 6
+
+
+class RoomIds:
+    """随机分配不重复的房间号
+
+    分配出去但房间还没建好的号码记在 pending 里，并发创建也不会拿到同一个号；
+    accept 用来只接受归本分片所有的号码。
+    """
+
+    def __init__(self, accept: Optional[Callable[[str], bool]] = None):
+        self.accept = accept
+        self.pending: Set[str] = set()
+        self._rng = random.Random(secrets.randbits(64))
+
+    def allocate(self, taken: Container[str]) -> str:
+        while True:
+            room_id = "".join(self._rng.choices(ROOM_ID_ALPHABET, k=ROOM_ID_LENGTH))
+            if room_id in taken or room_id in self.pending:
+                continue
+            if self.accept is None or self.accept(room_id):
+                self.pending.add(room_id)
+                return room_id
+
+    def release(self, room_id: str):
+        """房间建好（或创建失败）后调用"""
+        self.pending.discard(room_id)
+
+
+class Session(NamedTuple):
+    room_id: str
+    seat: int
+
+
+class SessionTable:
+    """token -> Session，以及 room_id -> 按座位排列的 token 列表
+
+    座位号就是玩家在 room.players 里的下标，开局后与引擎的座位号一致。
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Session] = {}
+        self.by_room: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, token: str) -> Optional[Session]:
+        return self.sessions.get(token)
+
+    def issue(self, room_id: str, token: Optional[str] = None) -> str:
+        """给房间里新加入的玩家（排在最后一个座位）签发令牌；恢复时传入原来的令牌"""
+        if token is None:
+            token = secrets.token_urlsafe(16)
+        tokens = self.by_room.setdefault(room_id, [])
+        self.sessions[token] = Session(room_id, len(tokens))
+        tokens.append(token)
+        return token
+
+    def remove_seat(self, room_id: str, seat: int):
+        """玩家离开房间：吊销令牌，后面的玩家座位号前移"""
+        tokens = self.by_room[room_id]
+        del self.sessions[tokens.pop(seat)]
+        for i in range(seat, len(tokens)):
+            self.sessions[tokens[i]] = Session(room_id, i)
+        if not tokens:
+            del self.by_room[room_id]
+
+    def drop_room(self, room_id: str):
+        for token in self.by_room.pop(room_id, ()):
+            del self.sessions[token]
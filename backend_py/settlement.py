@@ -0,0 +1,64 @@
+# 回合结算：持股矩阵上的赔付、按钱排名计分，以及每回合重新发牌用的整副牌
+# 不依赖引擎，只读写紧凑的数组，Game._end_round 用它；NumPy 批量引擎的向量化结算 batch.settle 与它逐项一致。
+# 与原来逐个玩家结算的写法是否一致见 tests/test_settlement.py。
+from itertools import accumulate
+from typing import Sequence
+
+# 每股欠最大股东的钱；名次加减分（第一、第二、最后）
+PAYOUT_PER_SHARE = 3
+PODIUM_POINTS = (2, 1, -1)
+
+
+class RoundSettlement:
+    """一种牌组配置下的结算器
+
+    持股矩阵 holdings 按 玩家 * 公司数 + 公司 平铺，money / score 每个玩家一项，
+    leader 每家公司一项（负数表示没有唯一的最大股东）。
+    整副牌在构造时生成一次，之后每回合只去掉移除的牌。
+    """
+
+    def __init__(self, card_counts: Sequence[int]):
+        self.width = len(card_counts)
+        self.base_deck = b"".join(bytes([c]) * count for c, count in enumerate(card_counts))
+        # 每家公司的牌在整副牌里开始的位置
+        self._starts = (0,) + tuple(accumulate(card_counts))[:-1]
+
+    def deck(self, removed: bytes = b"") -> bytearray:
+        """按公司顺序排列的整副牌，去掉 removed 中的牌"""
+        deck = bytearray(self.base_deck)
+        # 从后面的公司往前删，前面公司的位置不受影响
+        for c in sorted(removed, reverse=True):
+            del deck[self._starts[c]]
+        return deck
+
+    def settle(self, holdings, money, score, leader):
+        """结算一局：按公司顺序，每个人给最大股东付 持股数 * 3，付不起的部分只扣不给，
+        然后按钱排名计分，原地修改 money 和 score
+
+        公司之间有先后：前面公司收到的钱可以用来付后面的公司，所以按列依次处理；
+        同一列里最大股东自己不付钱，收到的钱攒到最后一起加。
+        没有持股的人 owed 为 0，钱已经是负数时 min 会从最大股东那里倒扣，与原规则保持一致。
+        """
+        width = self.width
+        players = len(money)
+        for c in range(width):
+            major = leader[c]
+            if major < 0:
+                continue
+            gained = 0
+            p = 0
+            for held in holdings[c::width]:
+                if p != major:
+                    owed = held * PAYOUT_PER_SHARE
+                    have = money[p]
+                    if owed or have < 0:
+                        gained += owed if have >= owed else have
+                        money[p] = have - owed
+                p += 1
+            money[major] += gained
+
+        # 稳定排序：并列时第一、第二取靠前的座位，最后一名取靠后的座位
+        ranking = sorted(range(players), key=money.__getitem__, reverse=True)
+        score[ranking[0]] += PODIUM_POINTS[0]
+        score[ranking[1]] += PODIUM_POINTS[1]
+        score[ranking[-1]] += PODIUM_POINTS[2]
@@ -0,0 +1,285 @@
+# 无头模拟器：不经过 FastAPI，直接用引擎跑完整局游戏
+# 用法（在 backend_py 目录下）：
+#   python -m sim --games 100000 --players 5 --policies greedy,random --workers 8
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from engine import HAND_SIZE, Game
+
+
+# ====== 合法动作 ======
+# 都取自 game.legal()，与引擎校验动作用的是同一份；不是当前玩家时没有合法动作
+def takable(game: Game, seat: int) -> List[int]:
+    """当前玩家可以从市场拿的牌的下标"""
+    legal = game.legal()
+    return list(legal.take) if legal.seat == seat else []
+
+
+def can_draw(game: Game, seat: int) -> bool:
+    legal = game.legal()
+    return legal.seat == seat and legal.can_draw
+
+
+def playable(game: Game, seat: int) -> List[Tuple[int, bool]]:
+    """(company, invest) 组合，去重"""
+    legal = game.legal()
+    if legal.seat != seat:
+        return []
+    moves = []
+    for c in legal.invest:
+        moves.append((c, True))
+        if c in legal.to_market:
+            moves.append((c, False))
+    return moves
+
+
+# ====== 机器人策略 ======
+class Policy:
+    """一个座位的出牌策略：先决定拿哪张牌，再决定打哪张牌"""
+
+    name = "base"
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def choose_take(self, game: Game, seat: int, options: List[int]) -> Optional[int]:
+        """返回市场牌下标，None 表示从牌库抽"""
+        raise NotImplementedError
+
+    def choose_play(
+        self, game: Game, seat: int, options: List[Tuple[int, bool]]
+    ) -> Tuple[int, bool]:
+        raise NotImplementedError
+
+
+class RandomPolicy(Policy):
+    name = "random"
+
+    def choose_take(self, game, seat, options):
+        if not can_draw(game, seat) or (options and self.rng.random() < 0.5):
+            return self.rng.choice(options)
+        return None
+
+    def choose_play(self, game, seat, options):
+        return self.rng.choice(options)
+
+
+class GreedyPolicy(Policy):
+    """优先争夺能成为最大股东的公司，市场上有金币的牌免费拿"""
+
+    name = "greedy"
+
+    def _value(self, game: Game, seat: int, company: int) -> int:
+        mine = game.holding(seat, company)
+        gap = game.top[company] - mine
+        if game.leader[company] == seat:
+            return 3
+        return 2 if gap <= 1 else 0
+
+    def choose_take(self, game, seat, options):
+        if options:
+            best = max(
+                options,
+                key=lambda i: (game.market_coins[i], self._value(game, seat, game.market[i])),
+            )
+            if (
+                not can_draw(game, seat)
+                or game.market_coins[best] > 0
+                or self._value(game, seat, game.market[best]) >= 2
+                or game.draw_cost(seat) > 2
+            ):
+                return best
+        return None
+
+    def choose_play(self, game, seat, options):
+        def score(move):
+            company, invest = move
+            value = self._value(game, seat, company)
+            # 不想要的牌丢到市场给对手付钱
+            return value if invest else 1 - value
+
+        best = max(score(m) for m in options)
+        return self.rng.choice([m for m in options if score(m) == best])
+
+
+POLICIES: Dict[str, type] = {p.name: p for p in (RandomPolicy, GreedyPolicy)}
+
+
+# ====== 单局模拟 ======
+class GameResult:
+    __slots__ = ("scores", "money", "winners", "turns", "stalled")
+
+    def __init__(self, game: Game, turns: int, stalled: bool):
+        self.scores = list(game.score)
+        self.money = list(game.money)
+        best = max(self.scores)
+        self.winners = [p for p, s in enumerate(self.scores) if s == best]
+        self.turns = turns
+        self.stalled = stalled
+
+
+def play_game(policies: Sequence[Policy], rng: random.Random) -> GameResult:
+    """跑完一局，policies[i] 坐在 i 号座位
+
+    手里 3 张牌、既抽不起牌市场上也没有能拿的牌时，跳过拿牌直接从手里打一张（规则允许）；
+    只有手里一张牌都没有、无牌可打时才无法继续，记为 stalled。
+    """
+    game = Game([f"bot{i}" for i in range(len(policies))], rng)
+    turns = 0
+    while game.status != "game_over":
+        seat = game.current
+        policy = policies[seat]
+        if len(game.hands[seat]) == HAND_SIZE:
+            options = takable(game, seat)
+            if options or can_draw(game, seat):
+                index = policy.choose_take(game, seat, options)
+                if index is None:
+                    game.draw(seat)
+                else:
+                    game.take(seat, index)
+        moves = playable(game, seat)
+        if not moves:
+            return GameResult(game, turns, stalled=True)
+        company, invest = policy.choose_play(game, seat, moves)
+        game.play(seat, company, invest)
+        turns += 1
+    return GameResult(game, turns, stalled=False)
+
+
+# ====== 批量运行 ======
+def _seat_policies(names: Sequence[str], players: int) -> List[str]:
+    """策略名按座位循环分配"""
+    return [names[i % len(names)] for i in range(players)]
+
+
+def run_chunk(args: Tuple[int, int, int, List[str], bool]) -> dict:
+    """一个进程跑 games 局，返回聚合后的统计，避免回传每局结果"""
+    seed, games, players, names, rotate = args
+    rng = random.Random(seed)
+    wins = [0.0] * players
+    policy_wins: Counter = Counter()
+    score_hist: Counter = Counter()
+    stalled = 0
+    turns = 0
+    for g in range(games):
+        seat_names = _seat_policies(names, players)
+        if rotate:
+            shift = g % players
+            seat_names = seat_names[shift:] + seat_names[:shift]
+        policies = [POLICIES[n](rng) for n in seat_names]
+        result = play_game(policies, rng)
+        turns += result.turns
+        if result.stalled:
+            stalled += 1
+            continue
+        share = 1.0 / len(result.winners)
+        for p in result.winners:
+            wins[p] += share
+            policy_wins[seat_names[p]] += share
+        score_hist.update(result.scores)
+    return {
+        "games": games,
+        "stalled": stalled,
+        "turns": turns,
+        "seat_wins": wins,
+        "policy_wins": dict(policy_wins),
+        "score_hist": dict(score_hist),
+    }
+
+
+def run_batch(
+    games: int,
+    players: int,
+    policies: Sequence[str],
+    workers: int = 0,
+    seed: int = 0,
+    chunk: int = 2000,
+    rotate: bool = True,
+) -> dict:
+    """在进程池里跑 games 局并汇总；workers=0 表示在当前进程里跑"""
+    for name in policies:
+        if name not in POLICIES:
+            raise ValueError(f"unknown policy {name!r}, choose from {sorted(POLICIES)}")
+    tasks = []
+    remaining, i = games, 0
+    while remaining > 0:
+        n = min(chunk, remaining)
+        tasks.append((seed * 1_000_003 + i, n, players, list(policies), rotate))
+        remaining -= n
+        i += 1
+
+    start = time.perf_counter()
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(run_chunk, tasks))
+    else:
+        parts = [run_chunk(t) for t in tasks]
+    elapsed = time.perf_counter() - start
+
+    seat_wins = [0.0] * players
+    policy_wins: Counter = Counter()
+    score_hist: Counter = Counter()
+    stalled = turns = 0
+    for part in parts:
+        stalled += part["stalled"]
+        turns += part["turns"]
+        for p, w in enumerate(part["seat_wins"]):
+            seat_wins[p] += w
+        policy_wins.update(part["policy_wins"])
+        score_hist.update({int(k): v for k, v in part["score_hist"].items()})
+
+    finished = games - stalled
+    seat_rates = [w / finished if finished else 0.0 for w in seat_wins]
+    return {
+        "games": games,
+        "players": players,
+        "policies": list(policies),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "games_per_sec": round(games / elapsed, 1) if elapsed else None,
+        "turns_per_game": round(turns / games, 2) if games else 0,
+        "stalled": stalled,
+        "seat_win_rate": [round(r, 4) for r in seat_rates],
+        # 先手优势：1 号座位胜率相对平均胜率的偏差
+        "first_player_advantage": round(seat_rates[0] - 1.0 / players, 4),
+        "policy_wins": {k: round(v, 1) for k, v in sorted(policy_wins.items())},
+        "score_distribution": dict(sorted(score_hist.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startups 无头模拟器")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=4, choices=range(3, 8))
+    parser.add_argument("--policies", default="greedy,random")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=2000)
+    parser.add_argument("--no-rotate", action="store_true", help="策略不轮换座位")
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    report = run_batch(
+        args.games,
+        args.players,
+        args.policies.split(","),
+        workers=args.workers,
+        seed=args.seed,
+        chunk=args.chunk,
+        rotate=not args.no_rotate,
+    )
+    if args.json:
+        print(json.dumps(report))
+        return
+    for key, value in report.items():
+        print(f"{key:24s} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from broadcast import Broadcaster
+from codec import dumps_text
+from metrics import SIZE_BUCKETS, histogram
+from state_stream import apply_ops
+
+# ====== 观战 ======
+# 观战连接不进房间频道，而是登记在 spectator_channel 上，由 SpectatorHub 统一下发：
+#   - 房间的公开广播先攒在每个房间的 pending 里，延迟 delay 秒后每 window 秒拼成一帧
+#     {"type": "spectate", "events": [...]}，整帧只编码一次，所有观众共用同一个字符串
+#   - hub 在服务端按帧维护一份延迟后的公开状态，新观众拿这份状态的 room_state，
+#     同一版本只编码一次；不会比其他观众看到更新的牌局
+# 玩家的广播路径上只多一次字典查找和一次 deque 追加，观众再多也不会拖慢玩家。
+
+BATCH_SIZE = histogram(
+    "startups_spectator_batch", "每帧观战消息合并的广播条数", buckets=SIZE_BUCKETS
+)
+
+# 这两类消息的序号不大于初始快照时，说明快照里已经包含了它，丢掉
+_SEQUENCED = ("game_started", "action")
+
+
+def spectator_channel(room_id: str) -> str:
+    """房间观众所在的频道；房间号只有字母和数字，不会与房间或玩家频道重名"""
+    return f"{room_id}#spectators"
+
+
+class _Feed:
+    __slots__ = ("pending", "seeded", "state", "seq", "base", "snapshot", "handle", "deleted")
+
+    def __init__(self):
+        # (到达时间, 已编码的消息, 解码后的消息或 None)
+        self.pending: deque = deque()
+        # 初始快照到达之前只缓冲，不下发
+        self.seeded = False
+        self.state: Optional[dict] = None
+        self.seq = 0
+        self.base = 0
+        self.snapshot: Optional[str] = None
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.deleted = False
+
+
+class SpectatorHub:
+    """按房间把公开广播延迟、合并后发给观众
+
+    open(room_id) 之后开始缓冲该房间的广播，seed(room_id, 快照) 放入初始状态；
+    之前到达、已经包含在快照里的消息会被丢掉。
+    """
+
+    def __init__(self, broadcaster: Broadcaster, delay: float = 0.0, window: float = 0.1):
+        self.broadcaster = broadcaster
+        self.delay = delay
+        self.window = window
+        self.feeds: Dict[str, _Feed] = {}
+
+    def watching(self, room_id: str) -> bool:
+        return room_id in self.feeds
+
+    def count(self) -> int:
+        connections = self.broadcaster.connections
+        return sum(len(connections.get(spectator_channel(r), ())) for r in self.feeds)
+
+    def open(self, room_id: str):
+        self.feeds.setdefault(room_id, _Feed())
+
+    def seed(self, room_id: str, snapshot: dict):
+        """第一位观众取到的快照，排在已经缓冲的广播前面"""
+        feed = self.feeds.get(room_id)
+        if feed is None:
+            return
+        text = dumps_text(snapshot)
+        arrived = feed.pending[0][0] if feed.pending else time.monotonic()
+        feed.pending.appendleft((arrived, text, json.loads(text)))
+        feed.base = snapshot.get("seq", 0)
+        feed.seeded = True
+        self._schedule(room_id, feed)
+
+    def offer(self, room_id: str, text: str):
+        """总线收到的每条广播都经过这里；没有观众的频道直接忽略"""
+        feed = self.feeds.get(room_id)
+        if feed is None:
+            return
+        feed.pending.append((time.monotonic(), text, None))
+        self._schedule(room_id, feed)
+
+    def snapshot(self, room_id: str) -> Optional[str]:
+        """新观众的初始快照（已编码），还没有状态时返回 None，等第一帧即可"""
+        feed = self.feeds.get(room_id)
+        if feed is None or feed.state is None:
+            return None
+        if feed.snapshot is None:
+            feed.snapshot = dumps_text(
+                {"type": "room_state", "seq": feed.seq, "data": feed.state}
+            )
+        return feed.snapshot
+
+    def close(self, room_id: str):
+        """最后一位观众离开"""
+        feed = self.feeds.pop(room_id, None)
+        if feed is not None and feed.handle is not None:
+            feed.handle.cancel()
+
+    def close_all(self):
+        for room_id in list(self.feeds):
+            self.close(room_id)
+
+    def _schedule(self, room_id: str, feed: _Feed):
+        if feed.handle is not None or not feed.pending or not feed.seeded:
+            return
+        wait = feed.pending[0][0] + self.delay + self.window - time.monotonic()
+        loop = asyncio.get_running_loop()
+        feed.handle = loop.call_later(max(0.0, wait), self._flush, room_id)
+
+    def _flush(self, room_id: str):
+        feed = self.feeds.get(room_id)
+        if feed is None:
+            return
+        feed.handle = None
+        due = time.monotonic() - self.delay
+        events = []
+        while feed.pending and feed.pending[0][0] <= due:
+            _, text, message = feed.pending.popleft()
+            if self._apply(feed, message if message is not None else json.loads(text)):
+                events.append(text)
+        if events:
+            BATCH_SIZE.observe(len(events))
+            feed.snapshot = None
+            frame = '{"type":"spectate","events":[' + ",".join(events) + "]}"
+            self.broadcaster.publish_text(spectator_channel(room_id), frame)
+        if feed.deleted:
+            self.close(room_id)
+            self.broadcaster.close_room(spectator_channel(room_id), 1001, "Room deleted")
+            return
+        self._schedule(room_id, feed)
+
+    def _apply(self, feed: _Feed, message: dict) -> bool:
+        """把一条广播作用到延迟后的状态上，返回是否要发给观众"""
+        kind = message.get("type")
+        seq = message.get("seq")
+        if kind in _SEQUENCED and seq is not None and seq <= feed.base:
+            return False
+        if kind in ("room_state", "game_started"):
+            feed.state = message["data"]
+        elif kind == "action" and feed.state is not None:
+            apply_ops(feed.state, message["ops"])
+        elif kind == "room_deleted":
+            feed.deleted = True
+        if seq is not None:
+            feed.seq = seq
+        return True
@@ -0,0 +1,101 @@
+import secrets
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+# ====== 房间状态流 ======
+class StateStream:
+    """单个房间的版本化状态流
+
+    每次 GameState 变更累积若干操作，提交时序号加一并生成一个补丁。
+    操作是紧凑数组，path 以 Room 为根，例如 ["game_state", "players", "aa", "money"]：
+      ["set", path, value]   设置 path 处的值
+      ["push", path, value]  向 path 处的列表追加元素
+      ["pop", path, index]   删除 path 处列表下标为 index 的元素（-1 表示末尾）
+    客户端发现序号不连续时请求快照即可重新对齐。
+    带 to 的操作只属于该玩家（例如自己的手牌），提交时单独放在 private 里。
+
+    history 是最近广播过的带序号消息（已编码）的环形缓冲，断线重连的客户端
+    只需补发它错过的那几条；落后太多、缓冲里已经没有时才需要快照。
+    同一个序号有公开和私有几条消息，缓冲满了挤掉的可能只是其中一部分，
+    _evicted 记着被挤掉过消息的最大序号，比它早的客户端不能补发。
+
+    序号不持久化，进程重启、房间恢复后从 0 重新开始。epoch 是每个状态流随机生成的编号，
+    随带序号的消息一起下发；客户端补发时要带上它，对不上说明序号已经不是同一套，只能发快照。
+    cache 存放当前版本的派生数据（例如各玩家的视图），每次提交时清空。
+    """
+
+    __slots__ = ("seq", "epoch", "_ops", "_private", "history", "_evicted", "cache")
+
+    def __init__(self, history: int = 64) -> None:
+        self.seq = 0
+        self.epoch = secrets.token_hex(4)
+        self._ops: List[list] = []
+        self._private: Dict[str, List[list]] = {}
+        self.history: deque = deque(maxlen=history)
+        self._evicted = 0
+        self.cache: Dict[Any, Any] = {}
+
+    def _add(self, op: list, to: Optional[str]) -> None:
+        if to is None:
+            self._ops.append(op)
+        else:
+            self._private.setdefault(to, []).append(op)
+
+    def set(self, path: List[Any], value: Any, to: Optional[str] = None) -> None:
+        self._add(["set", path, value], to)
+
+    def push(self, path: List[Any], value: Any, to: Optional[str] = None) -> None:
+        self._add(["push", path, value], to)
+
+    def pop(self, path: List[Any], index: int = -1, to: Optional[str] = None) -> None:
+        self._add(["pop", path, index], to)
+
+    def commit(self) -> Optional[dict]:
+        """提交累积的操作，返回 {"seq", "ops"}，有私有操作时另带 "private": {玩家: ops}；
+        没有变更时返回 None
+        """
+        if not self._ops and not self._private:
+            return None
+        self.seq += 1
+        patch = {"seq": self.seq, "ops": self._ops}
+        if self._private:
+            patch["private"] = self._private
+            self._private = {}
+        self._ops = []
+        self.cache.clear()
+        return patch
+
+    def record(self, seq: int, text: str, to: Optional[str] = None) -> None:
+        """记录一条已经广播的消息，seq 是它对应的补丁序号，to 是只发给某个玩家的消息"""
+        history = self.history
+        if len(history) == history.maxlen:
+            # 序号是递增的，最左边这条被挤掉后它那个序号就不完整了
+            self._evicted = history[0][0]
+        history.append((seq, to, text))
+
+    def since(self, seq: int, epoch: str, viewer: Optional[str] = None) -> Optional[List[str]]:
+        """viewer 在 seq 之后应收到的消息；epoch 不是本状态流的，或者缓冲里缺了 seq 之后的任何一条时返回 None"""
+        if epoch != self.epoch or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if seq < self._evicted or not self.history or self.history[0][0] > seq + 1:
+            return None
+        return [
+            text for s, to, text in self.history if s > seq and (to is None or to == viewer)
+        ]
+
+
+def apply_ops(doc: Any, ops: List[list]) -> None:
+    """把补丁里的操作作用到解码后的状态上，与客户端的实现相同"""
+    for op, path, value in ops:
+        target = doc
+        for key in path[:-1]:
+            target = target[key]
+        if op == "set":
+            target[path[-1]] = value
+        elif op == "push":
+            target[path[-1]].append(value)
+        else:
+            target[path[-1]].pop(value)
@@ -0,0 +1,5 @@
+# 测试直接导入 backend_py 下的模块，在任何目录下运行 pytest 都能找到
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,95 @@
+# 回合结算与原来逐个玩家结算的写法在随机状态上逐项比对（在 backend_py 目录下）：
+#   python -m pytest tests
+import random
+from array import array
+from typing import Sequence
+
+import pytest
+
+from settlement import PAYOUT_PER_SHARE, PODIUM_POINTS, RoundSettlement
+
+CARD_COUNTS = (5, 6, 7, 8, 9, 10)
+CASES = 2000
+
+
+# ====== 原来的写法 ======
+def reference_settle(holdings, money, score, leader, width: int):
+    """逐个公司、逐个玩家赔付，再把所有玩家按钱排序"""
+    n = len(money)
+    for company in range(width):
+        major = leader[company]
+        if major < 0:
+            continue
+        for p in range(n):
+            if p == major:
+                continue
+            owed = holdings[p * width + company] * PAYOUT_PER_SHARE
+            money[major] += min(money[p], owed)
+            money[p] -= owed
+    ranking = sorted(range(n), key=money.__getitem__, reverse=True)
+    score[ranking[0]] += PODIUM_POINTS[0]
+    score[ranking[1]] += PODIUM_POINTS[1]
+    score[ranking[-1]] += PODIUM_POINTS[2]
+
+
+def reference_deck(card_counts: Sequence[int], removed: bytes) -> bytearray:
+    """每回合从头生成整副牌，再逐张去掉移除的牌"""
+    deck = []
+    for c, count in enumerate(card_counts):
+        deck.extend([c] * count)
+    for c in removed:
+        deck.remove(c)
+    return bytearray(deck)
+
+
+def random_state(rng: random.Random, players: int, width: int) -> tuple:
+    """随机的结算前状态 (holdings, money, score, leader)；钱可以是负数（上一回合付不起时）"""
+    holdings = bytearray(rng.choice((0, 0, 1, 2, 3, 5)) for _ in range(players * width))
+    money = array("i", (rng.randint(-12, 30) for _ in range(players)))
+    score = array("i", (rng.randint(-2, 4) for _ in range(players)))
+    leader = array("b")
+    for c in range(width):
+        column = holdings[c::width]
+        top = max(column)
+        leader.append(column.index(top) if top and column.count(top) == 1 else -1)
+    return holdings, money, score, leader
+
+
+# ====== 比对 ======
+@pytest.mark.parametrize("players", range(3, 8))
+def test_settle_matches_reference(players):
+    settlement = RoundSettlement(CARD_COUNTS)
+    rng = random.Random(players)
+    for _ in range(CASES):
+        holdings, money, score, leader = random_state(rng, players, settlement.width)
+        want_money, want_score = array("i", money), array("i", score)
+        reference_settle(holdings, want_money, want_score, leader, settlement.width)
+        settlement.settle(holdings, money, score, leader)
+        assert (money, score) == (want_money, want_score)
+
+
+@pytest.mark.parametrize("players", range(3, 8))
+def test_vectorized_settle_matches_reference(players):
+    np = pytest.importorskip("numpy")
+    from batch import settle
+
+    width = len(CARD_COUNTS)
+    rng = random.Random(100 + players)
+    states = [random_state(rng, players, width) for _ in range(CASES)]
+    inv = np.array([list(s[0]) for s in states], np.int16).reshape(-1, players, width)
+    money = np.array([list(s[1]) for s in states], np.int32)
+    score = np.array([list(s[2]) for s in states], np.int32)
+    settle(inv, money, score)
+    for g, (holdings, want_money, want_score, leader) in enumerate(states):
+        reference_settle(holdings, want_money, want_score, leader, width)
+        assert money[g].tolist() == want_money.tolist()
+        assert score[g].tolist() == want_score.tolist()
+
+
+def test_deck_matches_reference():
+    settlement = RoundSettlement(CARD_COUNTS)
+    rng = random.Random(0)
+    assert settlement.deck() == reference_deck(CARD_COUNTS, b"")
+    for _ in range(CASES):
+        removed = bytes(rng.sample(settlement.base_deck, rng.randint(1, 8)))
+        assert settlement.deck(removed) == reference_deck(CARD_COUNTS, removed)
@@ -6,7 +6,7 @@ const API_BASE = import.meta.env.VITE_API_BASE_URL || 'localhost:8080';
 interface SocketContextType {
   socket: WebSocket | null;
   isConnected: boolean;
-  connect: (roomId: string, playerName: string) => void;
+  connect: (roomId: string, playerName: string, token: string) => void;
   disconnect: () => void;
 }
 
@@ -28,8 +28,9 @@ export const SocketProvider: React.FC<{ children: React.ReactNode }> = ({ childr
     socketRef.current = socket;
   }, [socket]);
 
-  const connect = useCallback((roomId: string, playerName: string) => {
-    const url = `ws://${API_BASE}/${roomId}/${playerName}`;
+  const connect = useCallback((roomId: string, playerName: string, token: string) => {
+    // 会话令牌证明自己是这个座位上的玩家，服务器凭它下发手牌
+    const url = `ws://${API_BASE}/${roomId}/${playerName}?token=${encodeURIComponent(token)}`;
 
     const currentWs=socketRef.current
 
@@ -71,6 +72,17 @@ export const SocketProvider: React.FC<{ children: React.ReactNode }> = ({ childr
       console.error("❌ WebSocket error", error);
     };
 
+    // 服务端心跳：收到 ping 立刻回 pong，长时间没有任何消息的连接会被服务端断开
+    ws.addEventListener("message", (event) => {
+      try {
+        if (JSON.parse(event.data).type === "ping") {
+          ws.send(JSON.stringify({ type: "pong" }));
+        }
+      } catch {
+        // 不是 JSON 的消息交给组件处理
+      }
+    });
+
     // 注意：不要在这里设置 onmessage！让组件自己 addEventListener
   }, []);
 
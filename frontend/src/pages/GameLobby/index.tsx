@@ -121,7 +121,7 @@ const GameLobby: React.FC = () => {
                     });
                     if (res) {
                       //创建Websocket
-                      connect(res.room_id,playerName);
+                      connect(res.room_id, playerName, res.token);
                       setRoomId(res.room_id)
                       navigate(`/game`, {
                         state: { room_id: res.room_id, type: "create" },
@@ -172,7 +172,7 @@ const GameLobby: React.FC = () => {
                           room_id: roomId,
                           player_name: playerName,
                         });
-                        connect(res.room_id, playerName);
+                        connect(res.room_id, playerName, res.token);
                         navigate(`/game`, {
                           state: { room_id: res.room_id },
                         });
@@ -37,7 +37,8 @@ type Card = `card${5 | 6 | 7 | 8 | 9 | 10}`;
 // 玩家的游戏状态
 interface PlayerGameState {
   player_id: string;
-  hand: Card[];
+  hand?: Card[]; // 只有自己的手牌
+  hand_size: number;
   investments: Record<Card, number>;
   money: number;
   score: number;
@@ -48,9 +49,9 @@ interface PlayerGameState {
 interface GameState {
   game_id: string;
   players: Record<string, PlayerGameState>;
-  market_deck: Card[];
+  market_deck_size: number;
   market_display: Card[]; // 当前为空数组，但保留类型
-  removed_cards: Card[];
+  removed_count: number;
   current_player_id: string;
   round_number: number;
   status: 'active' | string; // 可扩展其他状态
@@ -95,7 +96,9 @@ const GamePage: React.FC = () => {
     if (socket && isWaiting) {
       const handleMessage = (event: MessageEvent) => {
         try {
-          const data = JSON.parse(event.data).data;
+          const message = JSON.parse(event.data);
+          if (message.type === "ping") return;
+          const data = message.data;
           const players=data.players;
           const playerArray=[]
           for (let i = 0; i < players.length; i++) {